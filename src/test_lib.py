@@ -3,6 +3,12 @@ from workspace_for_agents.tasks.send_sva_files import (
     setup_task,
 )
 from workspace_for_agents.environment import create_environnement_from_file
+from workspace_for_agents.prefilter import TfidfLogisticScorer
+from workspace_for_agents.utils import (
+    configure_semantic_cache,
+    configure_semantic_prefilter,
+)
+import json
 import os
 
 parser = ArgumentParser()
@@ -22,6 +28,71 @@ parser.add_argument(
     action="store_true",
     help="Enable logging for llm_calls for semantic conditions",
 )
+parser.add_argument(
+    "--semantic_cache",
+    type=str,
+    default=None,
+    help="Path of a SQLite file used to persist semantic verdicts across runs",
+)
+parser.add_argument(
+    "--employee_workers",
+    type=int,
+    default=1,
+    help="Number of threads used to evaluate the employees' conditions concurrently",
+)
+parser.add_argument(
+    "--prefetch_dynamic_mails",
+    action="store_true",
+    help="Generate dynamic mails in the background as soon as they are sent",
+)
+parser.add_argument(
+    "--cassette",
+    type=str,
+    default=None,
+    help="Path of a JSON Lines file where LLM requests and responses are recorded",
+)
+parser.add_argument(
+    "--cassette_mode",
+    type=str,
+    default="replay",
+    choices=["record", "replay", "auto"],
+    help="record: call the LLM and save the answers, replay: answer offline from the cassette, auto: both",
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    default=None,
+    help="Path of the JSON profile report (a .folded flame graph file is saved next to it)",
+)
+parser.add_argument(
+    "--batch_semantic_checks",
+    action="store_true",
+    help="Resolve the semantic checks of each phase with a few batched LLM requests",
+)
+parser.add_argument(
+    "--prefilter_model",
+    type=str,
+    default=None,
+    help="Path of a prefilter model (see `python -m workspace_for_agents.prefilter`) answering the semantic checks it is confident about",
+)
+parser.add_argument(
+    "--prefilter_threshold",
+    type=float,
+    default=None,
+    help="Confidence above which the prefilter model answers, instead of the one it was trained with",
+)
+parser.add_argument(
+    "--prefilter_audit_rate",
+    type=float,
+    default=0.0,
+    help="Fraction of the confident prefilter answers still checked by the LLM to measure disagreements",
+)
+parser.add_argument(
+    "--record_verdicts",
+    type=str,
+    default=None,
+    help="Path of a JSON Lines file where the LLM semantic verdicts are appended, to train the prefilter",
+)
 
 args = parser.parse_args()
 
@@ -31,6 +102,24 @@ os.environ["LOG_CONDITIONS"] = str(args.log_conditions)
 os.environ["LOG_CALLS"] = str(args.log_calls)
 os.environ["LOG_SEMANTIC"] = str(args.log_semantic)
 os.environ["AGENT_TYPE"] = str(args.agent_type)
+if args.cassette:
+    os.environ["LLM_CASSETTE"] = args.cassette
+    os.environ["LLM_CASSETTE_MODE"] = args.cassette_mode
+configure_semantic_cache(path=args.semantic_cache)
+prefilter_stats = configure_semantic_prefilter(
+    (
+        TfidfLogisticScorer.load(args.prefilter_model, args.prefilter_threshold)
+        if args.prefilter_model
+        else None
+    ),
+    audit_rate=args.prefilter_audit_rate,
+    record_verdicts=args.record_verdicts,
+)
 env = create_environnement_from_file("src/envs/test_env_1.json")
+env.prefetch_dynamic_mails = args.prefetch_dynamic_mails
+env.batch_semantic_checks = args.batch_semantic_checks
 task = setup_task(env)
-env.run_task(task)
+env.run_task(
+    task, employee_workers=args.employee_workers, profile_path=args.profile
+)
+print("Semantic checks:", json.dumps(prefilter_stats.report(), indent=4))
@@ -1,20 +1,48 @@
 import ast
+import json
 import os
-import fitz
+import re
 
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from typing import Any, Callable, Optional
+from enum import IntEnum
+from typing import Any, Callable, Hashable, Optional
 from pathlib import Path
 
-from workspace_for_agents.file_system import File, Folder, create_folder_structure
+from workspace_for_agents.file_system import File, Folder
 from workspace_for_agents.mail import Email
+from workspace_for_agents.pdf_cache import get_pdf_cache
+from workspace_for_agents.profiling import profiler
+from workspace_for_agents.search import get_search_index
+from workspace_for_agents.utils import is_collecting_semantic_checks
+
+
+# Actions the agent can call, by function name
+ACTIONS: dict[str, type["Action"]] = {}
 
 
 class Action(ABC):
+    # Name of the function calling this action, if the agent can call it
+    name: Optional[str] = None
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        if cls.__dict__.get("name"):
+            ACTIONS[cls.name] = cls
+
     def __init__(self) -> None:
         self.source = None
 
+    @classmethod
+    def parameters(cls) -> list[str]:
+        """The parameter names of the function, as shown in its description."""
+        signature = cls.description().split("(", 1)[1].split(")", 1)[0]
+        return [
+            parameter.split(":")[0].strip()
+            for parameter in signature.split(",")
+            if parameter.strip()
+        ]
+
     @abstractmethod
     def description(self) -> str:
         pass
@@ -23,6 +51,11 @@ class Action(ABC):
     def execute(self):
         pass
 
+    @property
+    def reference(self) -> Optional[str]:
+        """Short description of what the action's output contains, e.g. when it is omitted."""
+        return None
+
     @property
     @abstractmethod
     def json(self):
@@ -30,6 +63,8 @@ class Action(ABC):
 
 
 class ReadMail(Action):
+    name = "read_mail"
+
     def __init__(self, mail_id: int) -> None:
         super().__init__()
         self.mail_id = mail_id
@@ -49,12 +84,18 @@ class ReadMail(Action):
                 f"ID should be an integer. `{self.mail_id}` is not an integer."
             )
 
+    @property
+    def reference(self) -> Optional[str]:
+        return f"mail {self.mail_id} read"
+
     @property
     def json(self):
         return {"mail_id": self.mail_id}
 
 
 class CheckMailBox(Action):
+    name = "check_mailbox"
+
     def __init__(self) -> None:
         super().__init__()
 
@@ -65,12 +106,18 @@ class CheckMailBox(Action):
     def execute(self, env):
         env.agent.short_term_context += env.agent.email_box.display()
 
+    @property
+    def reference(self) -> Optional[str]:
+        return "mailbox listed"
+
     @property
     def json(self):
         return {}
 
 
 class SendEmail(Action):
+    name = "send_mail_to"
+
     def __init__(
         self,
         receiver: str,
@@ -82,7 +129,8 @@ class SendEmail(Action):
         self.receiver = receiver
         self.object = object
         self.content = content
-        self.dynamic_content: Optional[str] = None
+        # Sent mail with a dynamic content, logged once generated
+        self.dynamic_email: Optional[Email] = None
         self.attached_file = attached_file
 
     @classmethod
@@ -110,15 +158,19 @@ class SendEmail(Action):
             content=self.content,
             turn=env.current_turn,
             attached_file=self.attached_file,
+            mail_id=env.email_ids.next_id(),
         )
-        if email._log != {} and os.environ["LOG_CALLS"] == "True":
-            env.add_log(
+        if os.environ["LOG_CALLS"] == "True":
+            email.on_generated = lambda log, source=self.source: env.add_log(
                 "dynamic_mail_debug",
-                self.source.name,
-                content=email._log,
+                source.name,
+                content=log,
             )
         if isinstance(self.content, Callable):
-            self.dynamic_content = email.content
+            # Not read here: reading email.content triggers the generation of the mail
+            self.dynamic_email = email
+        if env.prefetch_dynamic_mails:
+            email.prefetch()
         if "@company.com" in self.receiver:
             target_employee.email_box.received_emails.append(email)
 
@@ -128,7 +180,7 @@ class SendEmail(Action):
             if path.is_file():
                 target_employee.folders.append()
             elif path.is_dir():
-                folder = create_folder_structure(email.attached_file)
+                folder = env.file_index.get(email.attached_file)
                 target_employee.add_to_download_folder(folder)
             else:
                 pass
@@ -139,14 +191,17 @@ class SendEmail(Action):
             "sender": self.sender,
             "receiver": self.receiver,
             "object": self.object,
-            "content": self.dynamic_content if self.dynamic_content else self.content,
+            # The logged content is the mail that was sent, generated now if it wasn't yet
+            "content": self.dynamic_email.content if self.dynamic_email else self.content,
             "attached_file": self.attached_file,
         }
-        self.dynamic_content = None
+        self.dynamic_email = None
         return output
 
 
 class DisplayFiles(Action):
+    name = "display_files"
+
     def __init__(self):
         super().__init__()
 
@@ -160,42 +215,57 @@ class DisplayFiles(Action):
         else:
             env.agent.short_term_context += env.agent.list_available_files()
 
+    @property
+    def reference(self) -> Optional[str]:
+        return "files listed"
+
     @property
     def json(self):
         return {}
 
 
+def resolve_agent_path(agent, path: str) -> str:
+    """Replaces the `agent_downloads/...` prefix of a path by the path it links to."""
+    for agent_ref_path, absolute_path in agent.simlinks.items():
+        if absolute_path[-1] != "/":
+            absolute_path = absolute_path + "/"
+        path = path.replace(agent_ref_path, absolute_path)
+    return path
+
+
+def agent_facing_path(agent, path: str) -> str:
+    """The inverse of `resolve_agent_path`: the path as the agent sees it."""
+    normalized = os.path.normpath(path)
+    for agent_ref_path, absolute_path in agent.simlinks.items():
+        target = os.path.normpath(absolute_path)
+        if normalized == target or normalized.startswith(target + os.sep):
+            return agent_ref_path + os.path.relpath(normalized, target).replace(os.sep, "/")
+    return path
+
+
 def get_pdf_page_content_with_fitz(pdf_path, page_number):
     """
     Extracts and returns the content of a specified page from a PDF using PyMuPDF.
+    Documents and page texts are cached by `pdf_cache`.
 
     :param pdf_path: Path to the PDF file.
     :param page_number: Page number to extract (1-based index).
     :return: Text content of the specified page or an error message.
     """
     try:
-        # Open the PDF
-        pdf_document = fitz.open(pdf_path)
-        # Pages are zero-indexed in PyMuPDF, so subtract 1 from the page_number
-        if 1 <= page_number <= len(pdf_document):
-            page = pdf_document[page_number - 1]
-            page_content = page.get_text()
-            return page_content if page_content else "No text found on this page."
-        else:
-            return f"Invalid page number. The document has {len(pdf_document)} pages."
+        page_content = get_pdf_cache().page_text(pdf_path, int(page_number))
+        return page_content if page_content else "No text found on this page."
+    except IndexError as e:
+        return f"Invalid page number. {e}"
     except FileNotFoundError:
         return "The specified PDF file was not found."
     except Exception as e:
         return f"An error occurred: {e}"
-    finally:
-        # Ensure the document is closed after processing
-        try:
-            pdf_document.close()
-        except NameError:
-            pass
 
 
 class ReadPDFPage(Action):
+    name = "read_pdf_page"
+
     def __init__(self, pdf_file_path: str, page: int):
         super().__init__()
         self.pdf_file_path = pdf_file_path
@@ -206,12 +276,13 @@ class ReadPDFPage(Action):
         return "read_pdf_page(pdf_file_path: str, page_number: int) # Returns a string of the content of a PDF (note: pages enumeration start at 1)"
 
     def execute(self, env):
-        path = self.pdf_file_path
-        for agent_ref_path, absolute_path in env.agent.simlinks.items():
-            path = path.replace(agent_ref_path, absolute_path)
-
+        path = resolve_agent_path(env.agent, self.pdf_file_path)
         env.agent.short_term_context += get_pdf_page_content_with_fitz(path, self.page)
 
+    @property
+    def reference(self) -> Optional[str]:
+        return f"PDF {self.pdf_file_path} p.{self.page} read"
+
     @property
     def json(self):
         return {
@@ -221,6 +292,8 @@ class ReadPDFPage(Action):
 
 
 class ReadMarkdownFile(Action):
+    name = "read_markdown"
+
     def __init__(self, markdown_path: str):
         super().__init__()
         self.markdown_path = markdown_path
@@ -230,14 +303,14 @@ class ReadMarkdownFile(Action):
         return "read_markdown(markdown_path: str) # Returns a string of the content of a Markdown file"
 
     def execute(self, env):
-        path = self.markdown_path
-        for agent_ref_path, absolute_path in env.agent.simlinks.items():
-            if absolute_path[-1] != "/":
-                absolute_path = absolute_path + "/"
-            path = path.replace(agent_ref_path, absolute_path)
+        path = resolve_agent_path(env.agent, self.markdown_path)
         with open(path, "r", encoding="utf-8") as f:
             env.agent.short_term_context += f.read()
 
+    @property
+    def reference(self) -> Optional[str]:
+        return f"Markdown {self.markdown_path} read"
+
     @property
     def json(self):
         return {
@@ -245,7 +318,45 @@ class ReadMarkdownFile(Action):
         }
 
 
+class SearchFiles(Action):
+    name = "search_files"
+
+    def __init__(self, query: str):
+        super().__init__()
+        self.query = query
+
+    @classmethod
+    def description(self) -> str:
+        return "search_files(query: str) # Returns the PDF pages and Markdown passages of your files that best match the query"
+
+    def execute(self, env):
+        paths = [file.path for file in env.agent.files]
+        index = get_search_index()
+        index.update(paths)
+        hits = index.search(self.query, paths)
+        if not hits:
+            env.agent.short_term_context += f"No results found for `{self.query}`."
+            return
+        results = []
+        for hit in hits:
+            location = f"page {hit.page}" if hit.page else f"line {hit.line}"
+            results.append(f"- {agent_facing_path(env.agent, hit.path)} ({location}): {hit.snippet}")
+        env.agent.short_term_context += "\n".join(results)
+
+    @property
+    def reference(self) -> Optional[str]:
+        return f"search results for `{self.query}`"
+
+    @property
+    def json(self):
+        return {
+            "query": self.query,
+        }
+
+
 class DisplayContacts(Action):
+    name = "display_contacts"
+
     def __init__(self) -> None:
         super().__init__()
 
@@ -256,12 +367,18 @@ class DisplayContacts(Action):
     def execute(self, env):
         env.agent.short_term_context += env.agent.formated_contacts
 
+    @property
+    def reference(self) -> Optional[str]:
+        return "contacts listed"
+
     @property
     def json(self):
         return {}
 
 
 class SetTaskAsCompleted(Action):
+    name = "set_task_as_completed"
+
     def __init__(self) -> None:
         super().__init__()
 
@@ -278,6 +395,8 @@ class SetTaskAsCompleted(Action):
 
 
 class Wait(Action):
+    name = "wait"
+
     def __init__(self) -> None:
         super().__init__()
 
@@ -294,177 +413,351 @@ class Wait(Action):
 
 
 class NoActionAfterParsing(Action):
-    def __init__(self) -> None:
+    def __init__(self, error: Optional[str] = None) -> None:
         super().__init__()
+        self.error = error
 
     @classmethod
     def description(self) -> str:
         return "is taken when the parsing failed"
 
     def execute(self, env):
-        pass
+        if self.error and self.source is not None:
+            self.source.short_term_context += (
+                f"<Error> Your function call could not be parsed: {self.error} </Error>"
+            )
 
     @property
     def json(self):
-        return {}
+        return {"error": self.error}
+
+
+class ActionParseError(ValueError):
+    pass
+
 
+_NUMBER = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+_IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+_LITERALS = {"True": True, "False": False, "None": None}
+_CLOSING = {"(": ")", "[": "]", "{": "}"}
+_SPACES = re.compile(r"\s*")
+# String literals, by opening quote
+_STRINGS = {
+    '"""': re.compile(r'"""(?:[^\\]|\\.)*?"""', re.DOTALL),
+    "'''": re.compile(r"'''(?:[^\\]|\\.)*?'''", re.DOTALL),
+    '"': re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL),
+    "'": re.compile(r"'(?:[^'\\]|\\.)*'", re.DOTALL),
+}
+# Characters that matter when scanning a raw (unquoted) argument
+_RAW_SPECIAL = re.compile(r"[,()\[\]{}\"']")
 
-class ForceArgTextToString(ast.NodeTransformer):
+
+class _CallParser:
     """
-    If we see a call like: func(arg1, arg2, key=val),
-    we convert each arg/val (UNLESS it's already a constant)
-    into a string literal containing the original source code.
-
-    e.g.
-        send_mail_to(liam.grant@company.com, 42, some_func('x'))
-    becomes
-        send_mail_to("liam.grant@company.com", "42", "some_func('x')")
+    Single-pass parser for the `name(arg, ..., key=value)` grammar of the
+    agent's function calls. Python literals (strings, numbers, booleans, None)
+    keep their value, anything else is taken as text, e.g.
+        send_mail_to(liam.grant@company.com, 42, "Hi")
+    gives ("send_mail_to", ["liam.grant@company.com", 42, "Hi"], {}).
     """
 
-    def visit_Call(self, node: ast.Call) -> ast.AST:
-        # Keep the function name as is (so we can still do call_node.func.id later)
-        self.generic_visit(node.func)
-
-        # Now transform each positional argument
-        new_args = []
-        for arg in node.args:
-            if isinstance(arg, ast.Constant):
-                # Already a literal (str, int, float, bool, None), so keep it
-                new_args.append(arg)
-            else:
-                # Convert the entire node to a string constant
-                source_text = ast.unparse(self.visit(arg))
-                new_args.append(ast.Constant(value=source_text))
-        node.args = new_args
-
-        # Transform each keyword argument's value
-        for kw in node.keywords:
-            if kw.arg is not None:  # skip **kwargs, if any
-                if isinstance(kw.value, ast.Constant):
-                    # Already a literal
-                    continue
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.position = 0
+
+    def error(self, message: str) -> ActionParseError:
+        return ActionParseError(f"{message} (at character {self.position + 1} of `{self.text}`)")
+
+    def skip_spaces(self) -> None:
+        self.position = _SPACES.match(self.text, self.position).end()
+
+    def parse(self) -> tuple[str, list[Any], dict[str, Any]]:
+        self.skip_spaces()
+        match = _IDENTIFIER.match(self.text, self.position)
+        if not match:
+            raise self.error("Expected a function name")
+        name = match.group()
+        self.position = match.end()
+        self.skip_spaces()
+        if self.position >= len(self.text) or self.text[self.position] != "(":
+            raise self.error(f"Expected `(` after `{name}`")
+        self.position += 1
+
+        args: list[Any] = []
+        kwargs: dict[str, Any] = {}
+        self.skip_spaces()
+        if self.text.startswith(")", self.position):
+            self.position += 1
+        else:
+            while True:
+                keyword = self.parse_keyword()
+                value = self.parse_value()
+                if keyword:
+                    kwargs[keyword] = value
+                elif kwargs:
+                    raise self.error("Positional argument after a keyword argument")
                 else:
-                    source_text = ast.unparse(self.visit(kw.value))
-                    kw.value = ast.Constant(value=source_text)
+                    args.append(value)
+                self.skip_spaces()
+                if self.position >= len(self.text):
+                    raise self.error("Missing closing `)`")
+                separator = self.text[self.position]
+                self.position += 1
+                if separator == ")":
+                    break
+                # A single trailing comma is valid, e.g. `f("a", "b",)`
+                self.skip_spaces()
+                if self.text.startswith(")", self.position):
+                    self.position += 1
+                    break
+
+        self.skip_spaces()
+        if self.position < len(self.text):
+            raise self.error("Unexpected text after the function call")
+        return name, args, kwargs
+
+    def parse_keyword(self) -> Optional[str]:
+        self.skip_spaces()
+        match = _IDENTIFIER.match(self.text, self.position)
+        if match:
+            end = match.end()
+            while end < len(self.text) and self.text[end].isspace():
+                end += 1
+            if self.text.startswith("=", end) and not self.text.startswith("==", end):
+                self.position = end + 1
+                return match.group()
+        return None
+
+    def parse_value(self) -> Any:
+        self.skip_spaces()
+        start = self.position
+        if self.position < len(self.text) and self.text[self.position] in "\"'":
+            self.skip_string()
+            self.skip_spaces()
+            if self.position >= len(self.text) or self.text[self.position] in ",)":
+                return self.string_value(self.text[start : self.position].strip())
+            # e.g. "a" + b: taken as text, like any other expression
+
+        # Raw text, up to the next top-level `,` or `)`
+        self.position = start
+        depth: list[str] = []
+        while True:
+            match = _RAW_SPECIAL.search(self.text, self.position)
+            if not match:
+                self.position = len(self.text)
+                break
+            self.position = match.start()
+            char = match.group()
+            if char in "\"'":
+                self.skip_string()
+                continue
+            if char in _CLOSING:
+                depth.append(_CLOSING[char])
+            elif depth and char == depth[-1]:
+                depth.pop()
+            elif not depth and char in ",)":
+                break
+            self.position += 1
+        if depth:
+            raise self.error(f"Missing closing `{depth[-1]}`")
+
+        raw = self.text[start : self.position].strip()
+        if not raw:
+            if self.position >= len(self.text):
+                raise self.error("Missing closing `)`")
+            raise self.error("Empty argument")
+        if raw in _LITERALS:
+            return _LITERALS[raw]
+        if _NUMBER.fullmatch(raw):
+            return float(raw) if any(c in raw for c in ".eE") else int(raw)
+        return raw
+
+    def string_value(self, literal: str) -> str:
+        quote_length = 3 if literal[:3] in ('"""', "'''") else 1
+        if "\\" not in literal:
+            return literal[quote_length:-quote_length]
+        try:
+            return ast.literal_eval(literal)
+        except (SyntaxError, ValueError):
+            # Raw line breaks are frequent in generated mails, and invalid in "..."
+            try:
+                return ast.literal_eval(literal.replace("\r", "\\r").replace("\n", "\\n"))
+            except (SyntaxError, ValueError):
+                raise self.error(f"Invalid string {literal}")
 
-        return node
+    def skip_string(self) -> None:
+        quote = self.text[self.position]
+        if self.text.startswith(quote * 3, self.position):
+            quote *= 3
+        match = _STRINGS[quote].match(self.text, self.position)
+        if not match:
+            raise self.error(f"Unterminated string, missing closing {quote}")
+        self.position = match.end()
 
 
-def automatically_quote_call_args(expr: str) -> str:
+def parse_call(text: str) -> tuple[str, list[Any], dict[str, Any]]:
+    """Parses `name(arg, ..., key=value)`, raises ActionParseError with the reason if invalid."""
+    return _CallParser(text).parse()
+
+
+def parse_tool_call(text: str) -> tuple[str, list[Any], dict[str, Any]]:
     """
-    1) Parse expr as an AST in 'eval' mode.
-    2) Transform all call arguments (positional & keyword) into string constants
-       unless they're already constants.
-    3) Return unparsed code.
+    Parses a JSON tool call: {"name": ..., "arguments": {...} or [...]}, or
+    the OpenAI format {"function": {"name": ..., "arguments": "<JSON>"}}.
     """
     try:
-        tree = ast.parse(expr, mode="eval")
-    except SyntaxError:
-        # If not valid Python expression, just return as is (or handle differently)
-        return expr
-
-    transformed_tree = ForceArgTextToString().visit(tree)
-
-    # Return code re-generated from the modified AST
-    return ast.unparse(transformed_tree)
+        tool_call = json.loads(text)
+        if "function" in tool_call:
+            tool_call = tool_call["function"]
+        name = tool_call["name"]
+        arguments = tool_call.get("arguments", {})
+        if isinstance(arguments, str):
+            arguments = json.loads(arguments) if arguments.strip() else {}
+    except (ValueError, TypeError, KeyError) as e:
+        raise ActionParseError(f"Invalid JSON tool call: {e}")
+    if isinstance(arguments, list):
+        return name, arguments, {}
+    if isinstance(arguments, dict):
+        return name, [], arguments
+    raise ActionParseError("The arguments of a JSON tool call must be an object or a list")
+
+
+def instantiate_action(name: str, args: list[Any], kwargs: dict[str, Any]) -> Action:
+    if name not in ACTIONS:
+        raise ActionParseError(
+            f"Unknown function `{name}`, available functions: {', '.join(ACTIONS)}"
+        )
+    action_class = ACTIONS[name]
+    parameters = action_class.parameters()
+    if kwargs:
+        # Keyword arguments can use either the described names or the constructor's ones
+        args = list(args)
+        for parameter in parameters[len(args) :]:
+            if parameter in kwargs:
+                args.append(kwargs.pop(parameter))
+            else:
+                break
+    try:
+        return action_class(*args, **kwargs)
+    except TypeError:
+        raise ActionParseError(
+            f"Wrong arguments for `{name}`, expected: {action_class.description()}"
+        )
 
 
-# -----------------------
-# 3) The final parse_action function
-# -----------------------
+def parse_action(action_str: str) -> Action:
+    """
+    Parses a function call (or a JSON tool call) into the corresponding Action.
+    When it fails, a NoActionAfterParsing carrying the reason is returned, so
+    that the agent is told what went wrong.
+    """
+    action_str = action_str.strip()
+    try:
+        if action_str.startswith("{"):
+            name, args, kwargs = parse_tool_call(action_str)
+        else:
+            name, args, kwargs = parse_call(action_str)
+        return instantiate_action(name, args, kwargs)
+    except ActionParseError as e:
+        return NoActionAfterParsing(str(e))
 
 
-def parse_action(action_str: str) -> Optional[Action]:
+class Dependency(ABC):
     """
-    Attempts to parse a string command into an Action.
-    1) First, auto-quote all non-literal arguments (using ForceArgTextToString).
-    2) Then parse again for real.
-    3) Instantiate the corresponding Action if recognized, else NoActionAfterParsing().
+    Something a condition depends on. As long as the versions of all its
+    dependencies are unchanged, a condition's value is reused instead of being
+    re-evaluated.
     """
 
-    # STEP A: Automatically fix unquoted expressions in arguments
-    action_str = automatically_quote_call_args(action_str)
-    action_str = action_str.strip()
+    @abstractmethod
+    def version(self) -> Hashable:
+        pass
 
-    # Our action map
-    action_map = {
-        "check_mailbox": CheckMailBox,
-        "read_mail": ReadMail,
-        "wait": Wait,
-        "send_mail_to": SendEmail,
-        "display_contacts": DisplayContacts,
-        "read_pdf_page": ReadPDFPage,
-        "read_markdown": ReadMarkdownFile,
-        "display_files": DisplayFiles,
-        "set_task_as_completed": SetTaskAsCompleted,
-    }
-
-    # STEP B: Parse the transformed input as a Python expression
-    try:
-        tree = ast.parse(action_str, mode="eval")
-    except SyntaxError:
-        return NoActionAfterParsing()
 
-    # Must be a single expression that is a function call
-    if not isinstance(tree.body, ast.Call):
-        return NoActionAfterParsing()
+class MailboxChanged(Dependency):
+    def __init__(self, employee, box: Optional[str] = None) -> None:
+        # box: "received", "sent" or None for both
+        self.employee = employee
+        self.box = box
 
-    call_node = tree.body
+    def version(self) -> Hashable:
+        if self.box:
+            return self.employee.email_box.versions[self.box]
+        return self.employee.email_box.version
 
-    # Extract the function name
-    if not isinstance(call_node.func, ast.Name):
-        return NoActionAfterParsing()
 
-    action_name = call_node.func.id
+class TurnAdvanced(Dependency):
+    def __init__(self, env) -> None:
+        self.env = env
 
-    # Gather positional args
-    positional_args = []
-    for arg_ast in call_node.args:
-        if isinstance(arg_ast, ast.Constant):
-            positional_args.append(arg_ast.value)
-        else:
-            # Unexpected (shouldn't happen if auto-quoting worked)
-            return NoActionAfterParsing()
-
-    # Gather keyword args
-    keyword_args = {}
-    for kw_ast in call_node.keywords:
-        if kw_ast.arg is None:
-            # Possibly **kwargs, not handled
-            return NoActionAfterParsing()
-        if isinstance(kw_ast.value, ast.Constant):
-            keyword_args[kw_ast.arg] = kw_ast.value.value
-        else:
-            return NoActionAfterParsing()
+    def version(self) -> Hashable:
+        return self.env.current_turn
 
-    # Check if we know this action
-    if action_name not in action_map:
-        return NoActionAfterParsing()
 
-    action_class = action_map[action_name]
+class ActionCompleted(Dependency):
+    def __init__(self, conditioned_action: "ConditionedAction") -> None:
+        self.conditioned_action = conditioned_action
 
-    # Attempt to instantiate the Action
-    try:
-        return action_class(*positional_args, **keyword_args)
-    except Exception:
-        # If the signature doesn't match or some other error
-        return NoActionAfterParsing()
+    def version(self) -> Hashable:
+        return self.conditioned_action.is_completed
+
+
+class ConditionCost(IntEnum):
+    PYTHON = 0  # Pure python checks, e.g. on mailboxes or on the turn
+    LLM = 1  # Checks that may call an LLM, e.g. semantic_is_true
 
 
 class Condition:
     def __init__(
-        self, condition: Callable[[], bool], name: Optional[str] = None
+        self,
+        condition: Callable[[], bool],
+        name: Optional[str] = None,
+        depends_on: Optional[list[Dependency]] = None,
+        cost: ConditionCost = ConditionCost.PYTHON,
     ) -> None:
+        """
+        `depends_on` must list everything the condition's value depends on.
+        When it is None, the condition is re-evaluated every time.
+        `cost` is used by composite conditions to evaluate cheap children first.
+        """
         self.condition = condition
         self.name = self.condition.__name__
         if name:
             self.name = name
+        self.depends_on = depends_on
+        self.cost = cost
+        self.last_value: Optional[bool] = None
+        self._versions: Optional[tuple] = None
+
+    def _current_versions(self) -> Optional[tuple]:
+        if self.depends_on is None:
+            return None
+        return tuple(dependency.version() for dependency in self.depends_on)
+
+    @property
+    def effective_cost(self) -> ConditionCost:
+        # A condition whose dependencies didn't change is free to re-check
+        if self.depends_on is not None and self._current_versions() == self._versions:
+            return ConditionCost.PYTHON
+        return self.cost
 
     def is_true(self) -> bool:
+        with profiler.span(f"condition:{self.name}"):
+            if is_collecting_semantic_checks():
+                # Values computed while collecting semantic checks are placeholders
+                return self._compute()
+            versions = self._current_versions()
+            if versions is None or versions != self._versions:
+                self.last_value = self._compute()
+                self._versions = versions
+            return self.last_value
+
+    def _compute(self) -> bool:
         return self.condition()
 
-    def _evaluate(self) -> dict[str, str | bool]:
-        return {"name": self.name, "is_true": self.condition()}
+    def trace(self) -> dict[str, Any]:
+        """Reports the values computed by the last `is_true()`, without re-evaluating."""
+        return {"name": self.name, "is_true": self.last_value}
 
 
 class CompositeCondition(Condition):
@@ -472,42 +765,71 @@ class CompositeCondition(Condition):
     Base class for composite conditions that combine multiple Condition objects.
     """
 
+    condition_type = "composite_generic"
+
     def __init__(self, *conditions: Condition) -> None:
+        # A composite only declares dependencies if all of its children do
+        depends_on = None
+        if all(condition.depends_on is not None for condition in conditions):
+            depends_on = [
+                dependency
+                for condition in conditions
+                for dependency in condition.depends_on
+            ]
         # Instead of a single callable, store multiple Condition objects
-        super().__init__(lambda: None)  # We won't use this lambda directly
+        super().__init__(
+            lambda: None,  # Lambda never used
+            depends_on=depends_on,
+            cost=max(condition.cost for condition in conditions),
+        )
         self.conditions = conditions
+        self._evaluated: list[Condition] = []
 
-    def is_true(self) -> bool:
+    def _ordered_conditions(self) -> list[Condition]:
+        # sorted() is stable: conditions of the same cost keep their declaration order
+        return sorted(self.conditions, key=lambda condition: condition.effective_cost)
+
+    def _compute(self) -> bool:
         # Subclasses (AND/OR) must implement their own logic.
         raise NotImplementedError
 
-    def _evaluate(self) -> dict[str, Any]:
-        conditions_values = []
-        for condition in self.conditions:
-            conditions_values.append(condition._evaluate())
-        return {"condition_type": "composite_generic", "details": conditions_values}
+    def trace(self) -> dict[str, Any]:
+        return {
+            "condition_type": self.condition_type,
+            "is_true": self.last_value,
+            "details": [
+                (
+                    condition.trace()
+                    if condition in self._evaluated
+                    else {"name": condition.name, "is_true": "not evaluated"}
+                )
+                for condition in self.conditions
+            ],
+        }
 
 
 class AndCondition(CompositeCondition):
-    def is_true(self) -> bool:
-        return all(condition.is_true() for condition in self.conditions)
+    condition_type = "and_condition"
 
-    def _evaluate(self) -> dict[str, Any]:
-        conditions_values = []
-        for condition in self.conditions:
-            conditions_values.append(condition._evaluate())
-        return {"condition_type": "and_condition", "details": conditions_values}
+    def _compute(self) -> bool:
+        self._evaluated = []
+        for condition in self._ordered_conditions():
+            self._evaluated.append(condition)
+            if not condition.is_true():
+                return False
+        return True
 
 
 class OrCondition(CompositeCondition):
-    def is_true(self) -> bool:
-        return any(condition.is_true() for condition in self.conditions)
+    condition_type = "or_condition"
 
-    def _evaluate(self) -> dict[str, Any]:
-        conditions_values = []
-        for condition in self.conditions:
-            conditions_values.append(condition._evaluate())
-        return {"condition_type": "or_condition", "details": conditions_values}
+    def _compute(self) -> bool:
+        self._evaluated = []
+        for condition in self._ordered_conditions():
+            self._evaluated.append(condition)
+            if condition.is_true():
+                return True
+        return False
 
 
 @dataclass
@@ -522,9 +844,20 @@ class ConditionedAction:
     def __post_init__(self):
         if isinstance(self.condition, Callable):
             self.condition = Condition(self.condition)
+        self._requirements_met = False
+
+    @property
+    def requirements_met(self) -> bool:
+        # Completion is never undone, so once met, requirements stay met
+        if not self._requirements_met:
+            self._requirements_met = all(
+                requirement.is_completed for requirement in self.requires_completion
+            )
+        return self._requirements_met
 
     def add_requirement(self, requirement):
         self.requires_completion.append(requirement)
+        self._requirements_met = False
 
     def complete_requirement(self, requirement):
         if requirement in self.requires_completion:
@@ -3,9 +3,14 @@ from typing import Optional
 
 from pydantic import BaseModel, Field
 from workspace_for_agents.actions import Action, Wait, parse_action
-from workspace_for_agents.employee import Employee
+from workspace_for_agents.context_window import (
+    ContextWindow,
+    HistoryStep,
+    format_observation,
+)
+from workspace_for_agents.employee import Employee, EmployeeSnapshot
 from workspace_for_agents.file_system import File, Folder
-from workspace_for_agents.llm_client import client
+from workspace_for_agents.llm_client import completion_usage, get_client
 
 
 class Agent(Employee):
@@ -53,6 +58,39 @@ class Agent(Employee):
         if not download_folder_exists:
             self.folders.append(download_folder)
 
+    def _download_folder(self) -> Optional[Folder]:
+        return next(
+            (folder for folder in self.folders if folder.name == "agent_downloads"), None
+        )
+
+    def snapshot(self) -> EmployeeSnapshot:
+        snapshot = super().snapshot()
+        download_folder = self._download_folder()
+        snapshot.extra = dict(
+            short_term_context=self.short_term_context,
+            header=self.header,
+            simlinks=dict(self.simlinks),
+            downloads=(
+                (download_folder, len(download_folder.files), len(download_folder.subfolders))
+                if download_folder
+                else None
+            ),
+        )
+        return snapshot
+
+    def restore(self, snapshot: EmployeeSnapshot) -> None:
+        super().restore(snapshot)
+        self.short_term_context = snapshot.extra["short_term_context"]
+        self.header = snapshot.extra["header"]
+        self.simlinks = dict(snapshot.extra["simlinks"])
+        if snapshot.extra["downloads"]:
+            download_folder, files, subfolders = snapshot.extra["downloads"]
+            for subfolder in download_folder.subfolders[subfolders:]:
+                subfolder._parents.remove(download_folder)
+            del download_folder.files[files:]
+            del download_folder.subfolders[subfolders:]
+            download_folder._invalidate_tree()
+
     def choose_action(self) -> Action:
         return Wait()
 
@@ -75,6 +113,9 @@ class HumanAgent(Agent):
         return action
 
 
+SYSTEM_PROMPT = "You are <Agent> (agent@company.com), a helpful assistant that tries to help a company. You will be given a high-level goal to achieve, as well as functions to call. You must execute the appropriate actions to achieve the overarching objective. Note: the actions will actually take place only after calling wait(). Note: when writing the function, you will use double quotes around strings, not single quotes. Also, you will not write the explicit argument names."
+
+
 class ReActElement(BaseModel):
     reasoning: str = Field(description="The reasoning behind the function call")
     function_call: str = Field(
@@ -87,20 +128,34 @@ class GPTAgent(Agent):
         self,
         available_actions: list[Action],
         agent_description: str = "An abstract Agent.",
+        context_window: Optional[ContextWindow] = None,
     ):
         super().__init__(available_actions, agent_description)
-        self.history: list[str] = []
+        self.history = context_window if context_window is not None else ContextWindow()
+
+    def snapshot(self) -> EmployeeSnapshot:
+        snapshot = super().snapshot()
+        snapshot.extra["history"] = self.history.snapshot()
+        return snapshot
+
+    def restore(self, snapshot: EmployeeSnapshot) -> None:
+        super().restore(snapshot)
+        self.history.restore(snapshot.extra["history"])
+
+    @property
+    def system_prompt(self) -> str:
+        # Static for the whole episode, so that it stays a cacheable prompt prefix
+        return f"{SYSTEM_PROMPT}\n\nAVAILABLE FUNCTIONS:\n{self.actions_descriptions}\n\n{self.header}"
 
     def choose_action(self) -> Action:
-        history_string = "LAST ACTIONS: \n\n" + "\n".join(self.history)
-        prompt = f"{history_string}\n\n===CURRENT TURN===\n\n{self.short_term_context}\n\n{self.header}\n{self.actions_descriptions}"
-        completion = client.beta.chat.completions.parse(
+        # Rendered like the observations of the history, so that the next
+        # request only appends to this one
+        prompt = format_observation(self.short_term_context)
+        completion = get_client().parse(
             model="gpt-4o",
             messages=[
-                {
-                    "role": "system",
-                    "content": "You are <Agent> (agent@company.com), a helpful assistant that tries to help a company. You will be given a high-level goal to achieve, as well as functions to call. You must execute the appropriate actions to achieve the overarching objective. Note: the actions will actually take place only after calling wait(). Note: when writing the function, you will use double quotes around strings, not single quotes. Also, you will not write the explicit argument names.",
-                },
+                {"role": "system", "content": self.system_prompt},
+                *self.history.messages(),
                 {"role": "user", "content": prompt},
             ],
             response_format=ReActElement,
@@ -114,17 +169,20 @@ class GPTAgent(Agent):
                     "prompt": prompt,
                     "reasoning": react_response.reasoning,
                     "function_call": react_response.function_call,
+                    "usage": completion_usage(completion),
                 },
             )
 
-        history_log = str(
-            {
-                "reasoning": react_response.reasoning,
-                "function_call": react_response.function_call,
-                "function_output": self.short_term_context,
-            }
-        )
         action = parse_action(react_response.function_call)
-        self.history.append(history_log)
+        self.history.append(
+            HistoryStep(
+                reasoning=react_response.reasoning,
+                function_call=react_response.function_call,
+                function_output=self.short_term_context,
+                source_call=(
+                    self.history.steps[-1].function_call if self.history.steps else None
+                ),
+            )
+        )
         self.short_term_context = ""
         return action
@@ -0,0 +1,235 @@
+import importlib
+import itertools
+import json
+import os
+import random
+import time
+import traceback
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+
+from workspace_for_agents.environment import create_environnement_from_file
+from workspace_for_agents.llm_client import get_client
+from workspace_for_agents.prefilter import TfidfLogisticScorer
+from workspace_for_agents.profiling import get_profiler, merge_reports, save_report
+from workspace_for_agents.utils import configure_semantic_cache, configure_semantic_prefilter
+
+LOG_FLAGS = ["LOG_ACTIONS", "LOG_CONDITIONS", "LOG_CALLS", "LOG_SEMANTIC"]
+
+
+@dataclass
+class EpisodeSpec:
+    task_module: str
+    env_file: str
+    agent_type: str = "gpt"
+    seed: int = 0
+    repetition: int = 0
+    max_turns: int = 100
+    # Semantic checks prefilter, see `configure_semantic_prefilter`
+    prefilter_model: Optional[str] = None
+    prefilter_threshold: Optional[float] = None
+    prefilter_audit_rate: float = 0.0
+    record_verdicts: Optional[str] = None
+
+    @property
+    def episode_id(self) -> str:
+        task_name = self.task_module.split(".")[-1]
+        env_name = os.path.splitext(os.path.basename(self.env_file))[0]
+        return f"{task_name}-{env_name}-{self.agent_type}-s{self.seed}-r{self.repetition}"
+
+
+def expand_matrix(
+    task_modules: list[str],
+    env_files: list[str],
+    agent_types: list[str],
+    seeds: list[int],
+    repetitions: int = 1,
+    max_turns: int = 100,
+    **prefilter_options: Any,
+) -> list[EpisodeSpec]:
+    """`prefilter_options` are the prefilter fields of `EpisodeSpec`, shared by all the episodes."""
+    return [
+        EpisodeSpec(
+            task_module, env_file, agent_type, seed, repetition, max_turns, **prefilter_options
+        )
+        for task_module, env_file, agent_type, seed, repetition in itertools.product(
+            task_modules, env_files, agent_types, seeds, range(repetitions)
+        )
+    ]
+
+
+def run_episode(
+    spec: EpisodeSpec,
+    logs_dir: Optional[str] = None,
+    semantic_cache_path: Optional[str] = None,
+    profile: bool = False,
+) -> dict[str, Any]:
+    """
+    Runs a single episode. It is meant to be called in a fresh worker process,
+    so the environment variables and module-level state it sets up only
+    affect this episode.
+    """
+    for flag in LOG_FLAGS:
+        os.environ.setdefault(flag, "False")
+    if logs_dir:
+        os.environ["LOGS"] = "True"
+    else:
+        os.environ.pop("LOGS", None)
+    configure_semantic_cache(path=semantic_cache_path)
+    prefilter_stats = configure_semantic_prefilter(
+        (
+            TfidfLogisticScorer.load(spec.prefilter_model, spec.prefilter_threshold)
+            if spec.prefilter_model
+            else None
+        ),
+        audit_rate=spec.prefilter_audit_rate,
+        record_verdicts=spec.record_verdicts,
+    )
+    get_profiler().enabled = profile
+    random.seed(spec.seed)
+
+    task_module = spec.task_module
+    if "." not in task_module:
+        task_module = f"workspace_for_agents.tasks.{task_module}"
+
+    result: dict[str, Any] = {"episode_id": spec.episode_id, **asdict(spec)}
+    start = time.perf_counter()
+    try:
+        env = create_environnement_from_file(spec.env_file, agent_type=spec.agent_type)
+        task = importlib.import_module(task_module).setup_task(env)
+        result["setup_seconds"] = time.perf_counter() - start
+
+        run_start = time.perf_counter()
+        logs_path = (
+            os.path.join(logs_dir, f"{spec.episode_id}.json") if logs_dir else "logs.json"
+        )
+        result["scores"] = env.run_task(task, max_turns=spec.max_turns, logs_path=logs_path)
+        result["run_seconds"] = time.perf_counter() - run_start
+        result["llm_usage"] = get_client().usage_summary()
+        result["semantic_checks"] = prefilter_stats.report()
+        result["profile"] = env.profile
+        result["error"] = None
+    except Exception:
+        result["error"] = traceback.format_exc()
+    result["total_seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_batch(
+    specs: list[EpisodeSpec],
+    output_path: str,
+    workers: int = 4,
+    logs_dir: Optional[str] = None,
+    semantic_cache_path: Optional[str] = None,
+    profile: bool = False,
+) -> list[dict[str, Any]]:
+    """
+    With `profile`, every episode is profiled, and the profiles of all the
+    episodes are accumulated in `<output_path>.profile.json` (and `.folded`).
+    """
+    if logs_dir:
+        os.makedirs(logs_dir, exist_ok=True)
+
+    results: list[Optional[dict[str, Any]]] = [None] * len(specs)
+    # One process per episode, so that no state leaks from an episode to the next
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as executor:
+        futures = {
+            executor.submit(run_episode, spec, logs_dir, semantic_cache_path, profile): i
+            for i, spec in enumerate(specs)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            results[i] = future.result()
+            status = "error" if results[i]["error"] else "done"
+            print(f"[{done}/{len(specs)}] {specs[i].episode_id}: {status}")
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=4)
+    if profile:
+        profiles = [result["profile"] for result in results if result.get("profile")]
+        save_report(
+            merge_reports(profiles), os.path.splitext(output_path)[0] + ".profile.json"
+        )
+    return results
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Runs a matrix of episodes in parallel.")
+    parser.add_argument(
+        "--tasks", nargs="+", required=True, help="Task modules, e.g. send_sva_files"
+    )
+    parser.add_argument(
+        "--envs", nargs="+", default=["src/envs/test_env_1.json"], help="Env files"
+    )
+    parser.add_argument("--agent_types", nargs="+", default=["gpt"])
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0])
+    parser.add_argument("--repetitions", type=int, default=1)
+    parser.add_argument("--max_turns", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--output", type=str, default="results.json")
+    parser.add_argument(
+        "--logs_dir", type=str, default=None, help="Saves one log file per episode"
+    )
+    parser.add_argument(
+        "--semantic_cache",
+        type=str,
+        default=None,
+        help="Path of a SQLite file used to persist semantic verdicts across runs",
+    )
+    parser.add_argument(
+        "--prefilter_model",
+        type=str,
+        default=None,
+        help="Path of a prefilter model answering the semantic checks it is confident about",
+    )
+    parser.add_argument(
+        "--prefilter_threshold",
+        type=float,
+        default=None,
+        help="Confidence above which the prefilter model answers, instead of the one it was trained with",
+    )
+    parser.add_argument(
+        "--prefilter_audit_rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the confident prefilter answers still checked by the LLM",
+    )
+    parser.add_argument(
+        "--record_verdicts",
+        type=str,
+        default=None,
+        help="JSON Lines file where the LLM semantic verdicts of all the episodes are appended",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profiles every episode and saves the accumulated profile next to the results",
+    )
+    args = parser.parse_args()
+
+    specs = expand_matrix(
+        args.tasks,
+        args.envs,
+        args.agent_types,
+        args.seeds,
+        args.repetitions,
+        args.max_turns,
+        prefilter_model=args.prefilter_model,
+        prefilter_threshold=args.prefilter_threshold,
+        prefilter_audit_rate=args.prefilter_audit_rate,
+        record_verdicts=args.record_verdicts,
+    )
+    run_batch(
+        specs,
+        args.output,
+        workers=args.workers,
+        logs_dir=args.logs_dir,
+        semantic_cache_path=args.semantic_cache,
+        profile=args.profile,
+    )
+
+
+if __name__ == "__main__":
+    main()
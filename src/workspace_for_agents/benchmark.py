@@ -0,0 +1,348 @@
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+from workspace_for_agents.actions import (
+    Action,
+    AndCondition,
+    Condition,
+    ConditionCost,
+    ConditionedAction,
+    MailboxChanged,
+    SendEmail,
+    TurnAdvanced,
+    Wait,
+)
+from workspace_for_agents.agent import Agent
+from workspace_for_agents.bundle import compile_bundle
+from workspace_for_agents.environment import (
+    Environment,
+    create_environnement_from_file,
+)
+from workspace_for_agents.llm_client import FakeLLMClient, set_client
+from workspace_for_agents.mail import Email
+from workspace_for_agents.synthetic import TAGS, write_environment
+from workspace_for_agents.task import Goal, Task
+from workspace_for_agents.utils import configure_semantic_cache, semantic_is_true
+
+DEFAULT_RESULTS_PATH = os.path.join("benchmarks", "results.jsonl")
+# Metrics where a higher value is better, the others are durations or memory
+THROUGHPUT_METRICS = {"tag_queries_per_second", "mailbox_queries_per_second", "turns_per_second"}
+
+
+class BenchmarkAgent(Agent):
+    """Sends `mails_per_turn` mails to random employees, then waits."""
+
+    def __init__(
+        self, available_actions: list[Action], mails_per_turn: int = 10, seed: int = 0
+    ):
+        super().__init__(available_actions, "Benchmark agent")
+        self.mails_per_turn = mails_per_turn
+        self.rng = random.Random(seed)
+        self._sent_this_turn = 0
+
+    def choose_action(self) -> Action:
+        self.short_term_context = ""
+        if self._sent_this_turn >= self.mails_per_turn:
+            self._sent_this_turn = 0
+            return Wait()
+        self._sent_this_turn += 1
+        receiver = self.rng.choice(self.env.employees)
+        return SendEmail(receiver.email, "Benchmark", "Hello, could you help me?")
+
+
+def setup_benchmark_task(env: Environment, semantic_every: int = 100) -> Task:
+    """
+    Every employee replies once to the agent. Every 10th one also sends a
+    reminder after 5 turns without mail, and every `semantic_every`-th one
+    only replies if a (stubbed) semantic check passes.
+    """
+    for i, employee in enumerate(env.employees):
+        received_agent_mail = Condition(
+            lambda e=employee: bool(e.email_box.find(sender=env.agent.email)),
+            name="received-agent-mail",
+            depends_on=[MailboxChanged(employee, "received")],
+        )
+        condition = received_agent_mail
+        if semantic_every and i % semantic_every == 0:
+            condition = AndCondition(
+                received_agent_mail,
+                Condition(
+                    lambda e=employee: semantic_is_true(
+                        "The agent asked for help", e.email_box.display()
+                    ),
+                    name="agent-asked-for-help",
+                    depends_on=[MailboxChanged(employee, "received")],
+                    cost=ConditionCost.LLM,
+                ),
+            )
+        employee.preplanned_actions["reply-to-agent"] = ConditionedAction(
+            condition,
+            SendEmail(env.agent.email, "RE: Benchmark", "Sure, here is some help."),
+            score=1,
+        )
+        if i % 10 == 0:
+            employee.preplanned_actions["reminder"] = ConditionedAction(
+                Condition(
+                    lambda e=employee: env.current_turn >= 5
+                    and not e.email_box.find(sender=env.agent.email),
+                    name="no-agent-mail-after-5-turns",
+                    depends_on=[TurnAdvanced(env), MailboxChanged(employee, "received")],
+                ),
+                SendEmail(env.agent.email, "Reminder", "Are you still there?"),
+                score=0,
+            )
+
+    sampled_employees = env.employees[:10]
+    goal = Goal(
+        "sampled-employees-replied",
+        conditions=[
+            lambda e=employee: bool(env.agent.email_box.find(sender=e.email))
+            for employee in sampled_employees
+        ],
+    )
+    return Task("benchmark", "Benchmark the simulator", [goal], [])
+
+
+def _operations_per_second(operation: Callable[[int], Any], n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        operation(i)
+    elapsed = time.perf_counter() - start
+    return n / elapsed if elapsed else float("inf")
+
+
+def _stub_llm() -> FakeLLMClient:
+    client = FakeLLMClient()
+    set_client(client)
+    configure_semantic_cache()
+    return client
+
+
+def _load_environment(env_file: str, mails_per_turn: int, seed: int) -> Environment:
+    env = create_environnement_from_file(env_file, agent_type="human")
+    agent = BenchmarkAgent(env.agent.available_actions, mails_per_turn, seed)
+    env.agent = agent
+    agent.env = env
+    return env
+
+
+def _populate_mailboxes(env: Environment, n_mails: int, seed: int) -> None:
+    rng = random.Random(seed)
+    for _ in range(n_mails):
+        sender, receiver = rng.sample(env.employees, 2)
+        email = Email(
+            sender.email,
+            receiver.email,
+            "Synthetic",
+            "Synthetic mail",
+            turn=rng.randrange(100),
+            mail_id=env.email_ids.next_id(),
+        )
+        sender.email_box.sent_emails.append(email)
+        receiver.email_box.received_emails.append(email)
+
+
+def run_scenario(
+    n_employees: int,
+    workdir: str,
+    turns: int = 20,
+    mails_per_turn: int = 10,
+    queries: int = 1000,
+    measure_memory: bool = True,
+    seed: int = 0,
+) -> dict[str, Any]:
+    for flag in ["LOG_ACTIONS", "LOG_CONDITIONS", "LOG_CALLS", "LOG_SEMANTIC"]:
+        os.environ[flag] = "False"
+    os.environ.pop("LOGS", None)
+    rng = random.Random(seed)
+
+    start = time.perf_counter()
+    env_file = write_environment(
+        os.path.join(workdir, f"env_{n_employees}.json"),
+        n_employees,
+        os.path.join(workdir, f"files_{n_employees}"),
+        seed=seed,
+    )
+    result: dict[str, Any] = {
+        "employees": n_employees,
+        "turns": turns,
+        "mails_per_turn": mails_per_turn,
+        "generate_seconds": time.perf_counter() - start,
+    }
+
+    _stub_llm()
+    start = time.perf_counter()
+    env = _load_environment(env_file, mails_per_turn, seed)
+    result["load_seconds"] = time.perf_counter() - start
+
+    bundle_file = compile_bundle(env_file, os.path.splitext(env_file)[0] + ".bundle")
+    start = time.perf_counter()
+    _load_environment(bundle_file, mails_per_turn, seed)
+    result["bundle_load_seconds"] = time.perf_counter() - start
+
+    tag_queries = [rng.sample(TAGS, 2) for _ in range(queries)]
+    result["tag_queries_per_second"] = _operations_per_second(
+        lambda i: env.get_employees_by_tag(tag_queries[i]), queries
+    )
+
+    _populate_mailboxes(env, 10 * n_employees, seed)
+    mailboxes = [rng.choice(env.employees) for _ in range(queries)]
+    correspondents = [rng.choice(env.employees).email for _ in range(queries)]
+
+    def mailbox_query(i: int) -> None:
+        email_box = mailboxes[i].email_box
+        email_box.find(sender=correspondents[i])
+        email_box.find(receiver=correspondents[i], box="sent")
+        email_box.find(since_turn=i % 100, until_turn=i % 100 + 5)
+        email_box.get(i)
+
+    result["mailbox_queries_per_second"] = _operations_per_second(mailbox_query, queries)
+
+    task = setup_benchmark_task(env)
+    start = time.perf_counter()
+    env.run_task(task, max_turns=turns)
+    run_seconds = time.perf_counter() - start
+    result["run_seconds"] = run_seconds
+    result["turns_per_second"] = turns / run_seconds if run_seconds else float("inf")
+
+    # Cost of branching an episode: a checkpoint, one more turn, and back
+    start = time.perf_counter()
+    checkpoint = env.snapshot()
+    result["snapshot_seconds"] = time.perf_counter() - start
+    env.run_task(task, max_turns=1)
+    start = time.perf_counter()
+    env.restore(checkpoint)
+    result["restore_seconds"] = time.perf_counter() - start
+
+    if measure_memory:
+        # Separate pass, as tracing allocations slows everything down
+        del env, task
+        _stub_llm()
+        tracemalloc.start()
+        env = _load_environment(env_file, mails_per_turn, seed)
+        result["load_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.reset_peak()
+        env.run_task(setup_benchmark_task(env), max_turns=turns)
+        result["run_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path: str) -> list[dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_regressions(
+    result: dict[str, Any], previous: dict[str, Any], threshold: float = 0.1
+) -> list[str]:
+    """Lists the metrics that are more than `threshold` worse than in `previous`."""
+    regressions = []
+    for metric, value in result.items():
+        if not (metric.endswith("_second") or metric.endswith("_seconds") or metric.endswith("_mb")):
+            continue
+        if metric == "generate_seconds" or not previous.get(metric):
+            continue
+        ratio = value / previous[metric]
+        if metric in THROUGHPUT_METRICS:
+            ratio = 1 / ratio if ratio else float("inf")
+        if ratio > 1 + threshold:
+            regressions.append(f"{metric}: {previous[metric]:.4g} -> {value:.4g}")
+    return regressions
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Measures the simulator overhead on synthetic organizations, with a stubbed LLM."
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 10000])
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--mails_per_turn", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no_memory", action="store_true", help="Skip the memory pass")
+    parser.add_argument("--output", type=str, default=DEFAULT_RESULTS_PATH)
+    parser.add_argument("--label", type=str, default=None, help="Label stored with the results")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown above which a metric is reported as a regression",
+    )
+    parser.add_argument("--fail_on_regression", action="store_true")
+    args = parser.parse_args()
+
+    history = load_results(args.output)
+    metadata = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "label": args.label,
+        "python": platform.python_version(),
+    }
+    regressions = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            result = run_scenario(
+                size,
+                workdir,
+                turns=args.turns,
+                mails_per_turn=args.mails_per_turn,
+                queries=args.queries,
+                measure_memory=not args.no_memory,
+                seed=args.seed,
+            )
+            result = {**metadata, **result}
+            print(json.dumps(result, indent=4))
+
+            previous = next(
+                (
+                    entry
+                    for entry in reversed(history)
+                    if entry["employees"] == size
+                    and entry["turns"] == args.turns
+                    and entry["mails_per_turn"] == args.mails_per_turn
+                ),
+                None,
+            )
+            if previous:
+                for regression in find_regressions(result, previous, args.threshold):
+                    regressions.append(f"{size} employees, {regression}")
+
+            if os.path.dirname(args.output):
+                os.makedirs(os.path.dirname(args.output), exist_ok=True)
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    if regressions:
+        print("Regressions compared to the previous results:")
+        for regression in regressions:
+            print(f"- {regression}")
+        if args.fail_on_regression:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from argparse import ArgumentParser
+from array import array
+from typing import Any, Optional
+
+from workspace_for_agents.employee import Employee
+from workspace_for_agents.file_system import (
+    File,
+    FileTreeIndex,
+    Folder,
+    create_folder_structure,
+)
+from workspace_for_agents.pdf_cache import PDFDocumentPool, get_pdf_cache
+
+MAGIC = b"WFABUNDL"
+FORMAT_VERSION = 1
+# Separates the tags of an employee in the strings section
+TAGS_SEPARATOR = "\x1f"
+# Strings stored per employee: name, email, additional information, tags
+STRINGS_PER_EMPLOYEE = 4
+
+
+def is_bundle(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _encode_folder(folder: Folder) -> list:
+    return [
+        folder.name,
+        [file.name for file in folder.files],
+        [_encode_folder(subfolder) for subfolder in folder.subfolders],
+    ]
+
+
+def _decode_folder(path: str, encoded: list) -> Folder:
+    name, file_names, subfolders = encoded
+    folder = Folder(path, name)
+    # Appended directly: the tree is built once, then frozen
+    folder.files = [File(os.path.join(path, file_name), file_name) for file_name in file_names]
+    for subfolder in subfolders:
+        child = _decode_folder(os.path.join(path, subfolder[0]), subfolder)
+        child._parents.append(folder)
+        folder.subfolders.append(child)
+    return folder
+
+
+def _scan_folder(path: str) -> Folder:
+    # Same trees as FileTreeIndex.get
+    folder = create_folder_structure(path)
+    if folder is None:
+        folder = Folder(path, os.path.basename(path))
+    return folder
+
+
+def _extract_texts(folders: list[Folder]) -> dict[str, dict[str, Any]]:
+    documents = PDFDocumentPool()
+    texts = {}
+    for folder in folders:
+        for file in folder.iter_files():
+            key = os.path.normpath(file.path)
+            if not file.name.lower().endswith(".pdf") or key in texts:
+                continue
+            try:
+                stat = os.stat(file.path)
+                texts[key] = {
+                    "mtime_ns": stat.st_mtime_ns,
+                    "size": stat.st_size,
+                    "pages": documents.all_pages_text(file.path),
+                }
+            except Exception as e:
+                print(f"Warning! Couldn't extract the text of {file.path} ({e})")
+    documents.close()
+    return texts
+
+
+def compile_bundle(env_file: str, output_path: str, include_texts: bool = False) -> str:
+    """
+    Compiles an environment file, and the folder trees it references, into a
+    single bundle file that `load_bundle` memory-maps. With `include_texts`,
+    the text of the PDF pages is extracted and stored as well.
+    """
+    with open(env_file, "r", encoding="utf-8") as f:
+        env_data = json.load(f)
+
+    rows = {employee["id"]: row for row, employee in enumerate(env_data["employees"])}
+    ids = array("q")
+    string_offsets = array("q", [0])
+    strings = bytearray()
+    contact_offsets, contacts = array("i", [0]), array("i")
+    access_offsets, access = array("i", [0]), array("i")
+
+    folder_paths = [folder["path"] for folder in env_data["folders"]]
+    access_by_employee: dict[int, list[int]] = {}
+    for i, folder in enumerate(env_data["folders"]):
+        for employee_id in folder["has_access"]:
+            access_by_employee.setdefault(employee_id, []).append(i)
+
+    for employee in env_data["employees"]:
+        ids.append(employee["id"])
+        for string in [
+            employee["name"],
+            employee["email"],
+            employee["additional_information"],
+            TAGS_SEPARATOR.join(employee["tags"]),
+        ]:
+            strings += string.encode("utf-8")
+            string_offsets.append(len(strings))
+        contacts.extend(rows[contact_id] for contact_id in employee["contacts_ids"])
+        contact_offsets.append(len(contacts))
+        access.extend(access_by_employee.get(employee["id"], []))
+        access_offsets.append(len(access))
+
+    folders = [_scan_folder(path) for path in folder_paths]
+    tree_offsets, trees = array("q", [0]), bytearray()
+    for folder in folders:
+        trees += json.dumps(_encode_folder(folder), ensure_ascii=False).encode("utf-8")
+        tree_offsets.append(len(trees))
+
+    sections: dict[str, bytes] = {
+        "ids": ids.tobytes(),
+        "string_offsets": string_offsets.tobytes(),
+        "strings": bytes(strings),
+        "contacts_offsets": contact_offsets.tobytes(),
+        "contacts": contacts.tobytes(),
+        "access_offsets": access_offsets.tobytes(),
+        "access": access.tobytes(),
+        "tree_offsets": tree_offsets.tobytes(),
+        "trees": bytes(trees),
+    }
+    if include_texts:
+        sections["texts"] = json.dumps(_extract_texts(folders), ensure_ascii=False).encode(
+            "utf-8"
+        )
+
+    # Section offsets are relative to the end of the header, and 8-byte aligned
+    layout, position = {}, 0
+    for name, data in sections.items():
+        layout[name] = [position, len(data)]
+        position += len(data) + (-len(data) % 8)
+    header = json.dumps(
+        {
+            "byteorder": sys.byteorder,
+            "employees": len(ids),
+            "folders": folder_paths,
+            "sections": layout,
+        }
+    ).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<II", FORMAT_VERSION, len(header)) + header)
+        for data in sections.values():
+            f.write(data + b"\0" * (-len(data) % 8))
+    return output_path
+
+
+class Bundle:
+    """A memory-mapped bundle. Sections are only decoded when they are needed."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an environment bundle.")
+        version, header_length = struct.unpack_from("<II", self._mmap, len(MAGIC))
+        if version != FORMAT_VERSION:
+            raise ValueError(
+                f"{path} has format version {version}, expected {FORMAT_VERSION}. Compile it again."
+            )
+        start = len(MAGIC) + 8
+        self.header = json.loads(self._mmap[start : start + header_length])
+        if self.header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was compiled on a {self.header['byteorder']}-endian machine.")
+        self._data_start = start + header_length
+        self._view = memoryview(self._mmap)
+        self._folders: dict[int, Folder] = {}
+        self._texts: Optional[dict[str, dict[str, Any]]] = None
+
+    def _bytes(self, name: str) -> memoryview:
+        offset, length = self.header["sections"][name]
+        start = self._data_start + offset
+        return self._view[start : start + length]
+
+    def _array(self, name: str, typecode: str) -> memoryview:
+        # Zero-copy view of the section
+        return self._bytes(name).cast(typecode)
+
+    @property
+    def n_employees(self) -> int:
+        return self.header["employees"]
+
+    @property
+    def folder_paths(self) -> list[str]:
+        return self.header["folders"]
+
+    def employee_rows(self) -> list[tuple[int, str, str, str, list[str]]]:
+        """(id, name, email, additional information, tags) of every employee."""
+        ids = self._array("ids", "q")
+        offsets = self._array("string_offsets", "q")
+        strings = self._bytes("strings")
+        rows = []
+        for row in range(self.n_employees):
+            base = row * STRINGS_PER_EMPLOYEE
+            name, email, information, tags = [
+                str(strings[offsets[base + i] : offsets[base + i + 1]], "utf-8")
+                for i in range(STRINGS_PER_EMPLOYEE)
+            ]
+            rows.append((ids[row], name, email, information, tags.split(TAGS_SEPARATOR) if tags else []))
+        return rows
+
+    def _adjacency(self, name: str, row: int) -> list[int]:
+        offsets = self._array(f"{name}_offsets", "i")
+        return self._array(name, "i")[offsets[row] : offsets[row + 1]].tolist()
+
+    def contact_rows(self, row: int) -> list[int]:
+        return self._adjacency("contacts", row)
+
+    def folder_indexes(self, row: int) -> list[int]:
+        return self._adjacency("access", row)
+
+    def folder(self, index: int) -> Folder:
+        """The (frozen, shared) tree of the `index`-th folder, decoded on first use."""
+        if index not in self._folders:
+            offsets = self._array("tree_offsets", "q")
+            encoded = json.loads(bytes(self._bytes("trees")[offsets[index] : offsets[index + 1]]))
+            self._folders[index] = _decode_folder(self.folder_paths[index], encoded).freeze()
+        return self._folders[index]
+
+    def page_texts(self, pdf_path: str) -> Optional[list[str]]:
+        """The text of the pages of a PDF, if it was extracted and the file didn't change since."""
+        if "texts" not in self.header["sections"]:
+            return None
+        if self._texts is None:
+            self._texts = json.loads(bytes(self._bytes("texts")))
+        entry = self._texts.get(os.path.normpath(pdf_path))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(pdf_path)
+        except OSError:
+            return None
+        if (stat.st_mtime_ns, stat.st_size) != (entry["mtime_ns"], entry["size"]):
+            return None
+        return entry["pages"]
+
+
+class BundledEmployee(Employee):
+    """An employee whose contacts and folders are read from the bundle on first access."""
+
+    def __init__(self, bundle: Bundle, row: int, employees: list[Employee], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._bundle = bundle
+        self._row = row
+        # All the employees of the bundle, by row
+        self._bundle_employees = employees
+        self._contacts_map: Optional[dict[int, Employee]] = None
+        self._folders: Optional[list[Folder]] = None
+
+    @property
+    def contacts_map(self) -> dict[int, Employee]:
+        if self._contacts_map is None:
+            self._contacts_map = {}
+            for row in self._bundle.contact_rows(self._row):
+                contact = self._bundle_employees[row]
+                self._contacts_map.setdefault(contact.id, contact)
+        return self._contacts_map
+
+    @contacts_map.setter
+    def contacts_map(self, contacts_map: dict[int, Employee]) -> None:
+        self._contacts_map = contacts_map
+
+    @property
+    def folders(self) -> list[Folder]:
+        if self._folders is None:
+            self._folders = [
+                self._bundle.folder(index) for index in self._bundle.folder_indexes(self._row)
+            ]
+        return self._folders
+
+    @folders.setter
+    def folders(self, folders: list[Folder]) -> None:
+        self._folders = folders
+
+
+class BundleFileTreeIndex(FileTreeIndex):
+    """Serves the folder trees of the bundle, and scans the other folders as usual."""
+
+    def __init__(self, bundle: Bundle) -> None:
+        super().__init__()
+        self._bundle = bundle
+        self._bundle_folders = {
+            os.path.normpath(path): i for i, path in enumerate(bundle.folder_paths)
+        }
+
+    def get(self, path: str) -> Folder:
+        index = self._bundle_folders.get(os.path.normpath(path))
+        if index is not None:
+            return self._bundle.folder(index)
+        return super().get(path)
+
+
+def load_bundle(path: str) -> tuple[list[Employee], FileTreeIndex]:
+    """
+    Memory-maps a bundle and creates its employees. Contacts, folder trees
+    and document texts are only decoded when they are first used.
+    """
+    bundle = Bundle(path)
+    employees: list[Employee] = []
+    for row, (employee_id, name, email, information, tags) in enumerate(bundle.employee_rows()):
+        employees.append(
+            BundledEmployee(
+                bundle,
+                row,
+                employees,
+                id=employee_id,
+                name=name,
+                email=email,
+                additional_information=information,
+                tags=tags,
+            )
+        )
+    if "texts" in bundle.header["sections"]:
+        get_pdf_cache().add_source(bundle)
+    return employees, BundleFileTreeIndex(bundle)
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Compiles an environment file and its folder trees into a bundle that loads faster."
+    )
+    parser.add_argument("env_file", help="Environment JSON file")
+    parser.add_argument("output", help="Path of the bundle")
+    parser.add_argument(
+        "--texts", action="store_true", help="Also extract and store the text of the PDFs"
+    )
+    args = parser.parse_args()
+    compile_bundle(args.env_file, args.output, include_texts=args.texts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+def hash_key(*parts: str) -> str:
+    """Returns a stable sha256 digest of the provided parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        # Separator so that ("ab", "c") and ("a", "bc") don't collide
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class LRUCache:
+    def __init__(
+        self,
+        max_size: int = 4096,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+    ) -> None:
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                evicted_key, evicted_value = self._items.popitem(last=False)
+                if self.on_evict:
+                    self.on_evict(evicted_key, evicted_value)
+
+    def clear(self) -> None:
+        with self._lock:
+            if self.on_evict:
+                for key, value in self._items.items():
+                    self.on_evict(key, value)
+            self._items.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SQLiteStore:
+    """Small persistent key -> JSON value store backed by a SQLite file."""
+
+    def __init__(self, path: str, table: str = "cache", timeout: float = 60.0) -> None:
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        # The connection is shared between threads, accesses go through _lock
+        self._connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        # Several processes (e.g. batch workers) can share the file: with WAL,
+        # readers don't block the writer, and writers wait up to `timeout` for each other
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._connection.commit()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT value FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False)),
+            )
+            self._connection.commit()
+
+    def set_many(self, items: dict[str, Any]) -> None:
+        with self._lock:
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                [
+                    (key, json.dumps(value, ensure_ascii=False))
+                    for key, value in items.items()
+                ],
+            )
+            self._connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class SemanticCache:
+    """
+    Two-level cache for semantic verdicts: an in-memory LRU in front of an
+    optional on-disk SQLite store. Keys are content hashes of the model, the
+    condition and the rendered context.
+    """
+
+    def __init__(self, max_size: int = 4096, path: Optional[str] = None) -> None:
+        self.memory = LRUCache(max_size)
+        self.store: Optional[SQLiteStore] = (
+            SQLiteStore(path, "semantic_verdicts") if path else None
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, condition: str, context: str) -> str:
+        return hash_key(model, condition, context)
+
+    def get(self, key: str) -> Optional[bool]:
+        verdict = self.memory.get(key)
+        if verdict is None and self.store is not None:
+            verdict = self.store.get(key)
+            if verdict is not None:
+                self.memory.set(key, verdict)
+        if verdict is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return verdict
+
+    def set(self, key: str, verdict: bool) -> None:
+        self.memory.set(key, verdict)
+        if self.store is not None:
+            self.store.set(key, verdict)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,184 @@
+import json
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from workspace_for_agents.actions import parse_action
+from workspace_for_agents.llm_client import get_client
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough estimate (~4 characters per token), good enough for budgeting
+    return len(text) // 4
+
+
+def format_observation(observation: str) -> str:
+    return observation if observation else "No new observation."
+
+
+def output_reference(source_call: Optional[str], output: str) -> str:
+    """Replaces an omitted output, e.g. `[PDF report.pdf p.12 read, 3.4k chars]`."""
+    size = f"{len(output) / 1000:.1f}k chars"
+    if source_call is None:
+        return f"[observation omitted, {size}]"
+    reference = parse_action(source_call).reference
+    if reference is None:
+        return f"[output of {source_call} omitted, {size}]"
+    return f"[{reference}, {size}]"
+
+
+@dataclass
+class HistoryStep:
+    reasoning: str
+    function_call: str
+    # Observation received before `function_call`, i.e. the output of `source_call`
+    function_output: str
+    # Call of the previous step (None for the first step)
+    source_call: Optional[str] = None
+
+    def observation(self, max_output_chars: Optional[int] = None) -> str:
+        output = self.function_output
+        if max_output_chars is not None and len(output) > max_output_chars:
+            output = output_reference(self.source_call, output)
+        return format_observation(output)
+
+    def answer(self) -> str:
+        # Same layout as the structured answers of the model
+        return json.dumps(
+            {"reasoning": self.reasoning, "function_call": self.function_call},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+
+    def render(self, max_output_chars: Optional[int] = None) -> str:
+        return str(
+            {
+                "observation_source": self.source_call,
+                "observation": self.observation(max_output_chars),
+                "reasoning": self.reasoning,
+                "function_call": self.function_call,
+            }
+        )
+
+
+Summarizer = Callable[[str, list[HistoryStep]], str]
+
+
+def list_calls_summarizer(summary: str, steps: list[HistoryStep]) -> str:
+    """Default summarizer: keeps the function calls of the folded steps, without any LLM call."""
+    calls = summary.splitlines()[1:] if summary else []
+    calls += [f"- {step.function_call}" for step in steps]
+    # Only the most recent calls are kept, so that the summary stays bounded
+    calls = calls[-50:]
+    return "Earlier actions (outputs omitted):\n" + "\n".join(calls)
+
+
+def llm_summarizer(model: str = "gpt-4o-mini", max_tokens: int = 300) -> Summarizer:
+    def summarize(summary: str, steps: list[HistoryStep]) -> str:
+        steps_string = "\n".join(step.render(max_output_chars=2000) for step in steps)
+        completion = get_client().create(
+            model=model,
+            messages=[
+                {
+                    "role": "developer",
+                    "content": "You maintain a rolling summary of the actions taken by an agent. Each action shows the observation the agent received (the output of `observation_source`, the previous call), then its reasoning and the call it made. Update the summary with the new actions, keeping every fact that may be useful for the rest of the task (ids, emails, file paths, names, findings). Answer only with the updated summary.",
+                },
+                {
+                    "role": "user",
+                    "content": f"Current summary:\n{summary}\n\nNew actions:\n{steps_string}",
+                },
+            ],
+            max_tokens=max_tokens,
+        )
+        return completion.choices[0].message.content
+
+    return summarize
+
+
+class ContextWindow:
+    """
+    History of the agent's steps, rendered within a token budget. Steps are
+    kept verbatim until the budget is exceeded. The history is then compacted
+    in one go: the outputs larger than `max_output_chars` of all the steps but
+    the last `keep_last` are replaced by a reference and, if still needed, the
+    oldest steps are folded into a rolling summary. Between two compactions,
+    the rendering is append-only, which keeps the prompt prefix cacheable.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 16000,
+        keep_last: int = 10,
+        max_output_chars: int = 2000,
+        summarizer: Summarizer = list_calls_summarizer,
+    ) -> None:
+        self.token_budget = token_budget
+        self.keep_last = keep_last
+        self.max_output_chars = max_output_chars
+        self.summarizer = summarizer
+        self.steps: list[HistoryStep] = []
+        self.summary = ""
+        self.summarized_steps = 0
+        self.compacted_steps = 0
+
+    def append(self, step: HistoryStep) -> None:
+        self.steps.append(step)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def snapshot(self) -> tuple[int, str, int, int]:
+        # Steps are never modified once appended
+        return (len(self.steps), self.summary, self.summarized_steps, self.compacted_steps)
+
+    def restore(self, snapshot: tuple[int, str, int, int]) -> None:
+        steps, self.summary, self.summarized_steps, self.compacted_steps = snapshot
+        del self.steps[steps:]
+
+    def _rendered_steps(self) -> list[tuple[HistoryStep, Optional[int]]]:
+        """The visible steps, with the output limit each one is rendered with."""
+        compacted_start = max(self.summarized_steps, self.compacted_steps)
+        return [
+            (step, self.max_output_chars)
+            for step in self.steps[self.summarized_steps : compacted_start]
+        ] + [(step, None) for step in self.steps[compacted_start:]]
+
+    def _render(self) -> list[str]:
+        parts = [self.summary] if self.summary else []
+        parts += [
+            step.render(max_output_chars)
+            for step, max_output_chars in self._rendered_steps()
+        ]
+        return parts
+
+    def compact(self) -> None:
+        """Compacts the history until it fits in the token budget (or can't be compacted further)."""
+        if estimate_tokens("\n".join(self._render())) <= self.token_budget:
+            return
+        self.compacted_steps = max(self.compacted_steps, len(self.steps) - self.keep_last)
+        while (
+            estimate_tokens("\n".join(self._render())) > self.token_budget
+            and self.summarized_steps < len(self.steps) - self.keep_last
+        ):
+            # Folds the oldest half of the older steps at once, to limit summarizer calls
+            older_steps = len(self.steps) - self.keep_last - self.summarized_steps
+            folded = self.steps[
+                self.summarized_steps : self.summarized_steps + max(1, older_steps // 2)
+            ]
+            self.summary = self.summarizer(self.summary, folded)
+            self.summarized_steps += len(folded)
+
+    def messages(self) -> list[dict]:
+        """
+        The history as chat messages: each step is the observation the agent
+        received (user) followed by its answer (assistant).
+        """
+        self.compact()
+        messages = []
+        if self.summary:
+            messages.append({"role": "user", "content": self.summary})
+        for step, max_output_chars in self._rendered_steps():
+            messages.append(
+                {"role": "user", "content": step.observation(max_output_chars)}
+            )
+            messages.append({"role": "assistant", "content": step.answer()})
+        return messages
@@ -0,0 +1,100 @@
+from typing import TYPE_CHECKING, Iterable, Optional
+
+if TYPE_CHECKING:
+    from workspace_for_agents.employee import Employee
+
+
+class EmployeeDirectory:
+    """
+    Indexes of the employees by id, email, name and (case-insensitive) tag.
+    Employees notify the directories they belong to when their email, name
+    or tags change, so that the indexes stay up to date.
+    """
+
+    def __init__(self, employees: Iterable["Employee"] = ()) -> None:
+        self.employees: list[Employee] = []
+        self._positions: dict[int, int] = {}
+        self.by_id: dict[int, list[Employee]] = {}
+        self.by_email: dict[str, list[Employee]] = {}
+        self.by_name: dict[str, list[Employee]] = {}
+        self.by_tag: dict[str, list[Employee]] = {}
+        for employee in employees:
+            self.add(employee)
+
+    def add(self, employee: "Employee") -> None:
+        self._positions[id(employee)] = len(self.employees)
+        self.employees.append(employee)
+        self.by_id.setdefault(employee.id, []).append(employee)
+        self.by_email.setdefault(employee.email, []).append(employee)
+        self.by_name.setdefault(employee.name, []).append(employee)
+        for tag in self._tags(employee):
+            self.by_tag.setdefault(tag, []).append(employee)
+        employee._directories.append(self)
+
+    def remove(self, employee: "Employee") -> None:
+        """Removes `employee` from the indexes, and stops following its changes."""
+        self.employees = [e for e in self.employees if e is not employee]
+        self._positions = {id(e): i for i, e in enumerate(self.employees)}
+        for index in (self.by_id, self.by_email, self.by_name, self.by_tag):
+            for key, employees in list(index.items()):
+                if any(e is employee for e in employees):
+                    index[key] = [e for e in employees if e is not employee]
+                    if not index[key]:
+                        del index[key]
+        employee._directories[:] = [d for d in employee._directories if d is not self]
+
+    def detach(self) -> None:
+        """Stops following the changes of all the employees, e.g. when the directory is replaced."""
+        for employee in self.employees:
+            employee._directories[:] = [d for d in employee._directories if d is not self]
+
+    @staticmethod
+    def _tags(employee: "Employee") -> set[str]:
+        return {tag.lower() for tag in employee.tags}
+
+    def _move(
+        self, index: dict, employee: "Employee", old_key, new_key
+    ) -> None:
+        if old_key in index:
+            index[old_key] = [e for e in index[old_key] if e is not employee]
+            if not index[old_key]:
+                del index[old_key]
+        # Keeps the directory order, so that lookups return the first employee of the list
+        employees = index.setdefault(new_key, [])
+        employees.append(employee)
+        employees.sort(key=lambda e: self._positions[id(e)])
+
+    def _email_changed(self, employee: "Employee", old_email: str) -> None:
+        self._move(self.by_email, employee, old_email, employee.email)
+
+    def _name_changed(self, employee: "Employee", old_name: str) -> None:
+        self._move(self.by_name, employee, old_name, employee.name)
+
+    def _tags_changed(self, employee: "Employee") -> None:
+        for tag, employees in list(self.by_tag.items()):
+            if employee in employees:
+                employees.remove(employee)
+                if not employees:
+                    del self.by_tag[tag]
+        for tag in self._tags(employee):
+            self._move(self.by_tag, employee, None, tag)
+
+    def get_by_id(self, employee_id: int) -> Optional["Employee"]:
+        employees = self.by_id.get(employee_id)
+        return employees[0] if employees else None
+
+    def get_by_email(self, email: str) -> Optional["Employee"]:
+        employees = self.by_email.get(email)
+        return employees[0] if employees else None
+
+    def get_by_name(self, name: str) -> Optional["Employee"]:
+        employees = self.by_name.get(name)
+        return employees[0] if employees else None
+
+    def with_tags(self, tags: list[str]) -> list["Employee"]:
+        """The employees having at least one of the `tags`, in directory order."""
+        matches: dict[int, Employee] = {}
+        for tag in {tag.lower() for tag in tags}:
+            for employee in self.by_tag.get(tag, []):
+                matches[id(employee)] = employee
+        return sorted(matches.values(), key=lambda e: self._positions[id(e)])
@@ -1,10 +1,63 @@
 import os
-from typing import Self
+from dataclasses import dataclass
+from typing import Any, Optional, Self
 
 
-from workspace_for_agents.mail import EmailBox
-from workspace_for_agents.actions import Action, ConditionedAction
-from workspace_for_agents.file_system import File, Folder
+from workspace_for_agents.mail import EmailBox, MailboxSnapshot
+from workspace_for_agents.actions import Action, Condition, ConditionedAction
+from workspace_for_agents.directory import EmployeeDirectory
+from workspace_for_agents.file_system import File, FileTreeIndex, Folder
+from workspace_for_agents.profiling import profiler
+
+
+class TagList(list):
+    """A list of tags that keeps the directories of its employee up to date."""
+
+    def __init__(self, employee: "Employee", tags: list[str]) -> None:
+        super().__init__(tags)
+        self._employee = employee
+
+    def _mutating(method_name: str):
+        def method(self, *args, **kwargs):
+            result = getattr(list, method_name)(self, *args, **kwargs)
+            for directory in self._employee._directories:
+                directory._tags_changed(self._employee)
+            return result
+
+        return method
+
+    append = _mutating("append")
+    extend = _mutating("extend")
+    insert = _mutating("insert")
+    remove = _mutating("remove")
+    pop = _mutating("pop")
+    clear = _mutating("clear")
+    __setitem__ = _mutating("__setitem__")
+    __delitem__ = _mutating("__delitem__")
+    __iadd__ = _mutating("__iadd__")
+    del _mutating
+
+
+@dataclass(slots=True)
+class EmployeeSnapshot:
+    """
+    The state of an employee that changes during an episode. Its profile,
+    contacts and shared folders are not copied.
+    """
+
+    # None if the employee had no mailbox yet
+    email_box: Optional[MailboxSnapshot]
+    folders: int
+    actions: int
+    known_facts: int
+    instructions: int
+    preplanned_actions: dict[str, ConditionedAction]
+    # Flat tuples rather than an object per action, as snapshots of large organizations are frequent
+    completed: tuple[bool, ...]
+    requirements_met: tuple[bool, ...]
+    requirements: Optional[dict[str, tuple]]
+    # State of the subclasses, e.g. the agent's history
+    extra: Optional[dict[str, Any]] = None
 
 
 class Employee:
@@ -16,19 +69,61 @@ class Employee:
         additional_information: str,
         tags: list[str] = [],
     ):
+        # Directories indexing this employee, notified when the email, name or tags change
+        self._directories: list[EmployeeDirectory] = []
         self.id = id
-        self.name = name
-        self.email = email
+        self._name = name
+        self._email = email
         self.additional_information = additional_information
         self.contacts_map: dict[int, Self] = {}
         self.known_facts: list[str] = []
         self.folders: list[Folder] = []
-        self.files: list[File] = []
         self.actions: list[Action] = []
-        self.email_box = EmailBox()
+        # Created on first use, most employees of large organizations never get a mail
+        self._email_box: Optional[EmailBox] = None
         self.preplanned_actions: dict[str, ConditionedAction] = {}
         self.instructions: list[str] = []
-        self.tags = tags
+        self._tags = TagList(self, tags)
+
+    @property
+    def email_box(self) -> EmailBox:
+        if self._email_box is None:
+            self._email_box = EmailBox()
+        return self._email_box
+
+    @email_box.setter
+    def email_box(self, email_box: EmailBox) -> None:
+        self._email_box = email_box
+
+    @property
+    def email(self) -> str:
+        return self._email
+
+    @email.setter
+    def email(self, email: str) -> None:
+        old_email, self._email = self._email, email
+        for directory in self._directories:
+            directory._email_changed(self, old_email)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, name: str) -> None:
+        old_name, self._name = self._name, name
+        for directory in self._directories:
+            directory._name_changed(self, old_name)
+
+    @property
+    def tags(self) -> TagList:
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags: list[str]) -> None:
+        self._tags = TagList(self, tags)
+        for directory in self._directories:
+            directory._tags_changed(self)
 
     @property
     def formated_instructions(self):
@@ -49,29 +144,20 @@ class Employee:
         else:
             self.contacts_map[employee.id] = employee
 
-    def add_files_from_folder(self, folder_path: str):
-        # Create root folder
-        folder_name = os.path.basename(folder_path)
-        root_folder = Folder(folder_path, folder_name)
-        self.folders.append(root_folder)
-
-        # Walk through directory
-        for dirpath, dirnames, filenames in os.walk(folder_path):
-            # Create current folder
-            current_folder = root_folder
-            if dirpath != folder_path:
-                rel_path = os.path.relpath(dirpath, folder_path)
-                for folder_name in rel_path.split(os.sep):
-                    new_folder = Folder(os.path.join(dirpath, folder_name), folder_name)
-                    current_folder.add_subfolder(new_folder)
-                    current_folder = new_folder
-
-            # Add files in current folder
-            for filename in filenames:
-                file_path = os.path.join(dirpath, filename)
-                file = File(file_path, filename)
-                current_folder.add_file(file)
-                self.files.append(file)
+    def add_folder(self, folder: Folder):
+        self.folders.append(folder)
+
+    def add_files_from_folder(
+        self, folder_path: str, file_index: Optional[FileTreeIndex] = None
+    ):
+        # With a shared file index, the folder is only scanned once for all employees
+        if file_index is None:
+            file_index = FileTreeIndex()
+        self.add_folder(file_index.get(folder_path))
+
+    @property
+    def files(self) -> list[File]:
+        return [file for folder in self.folders for file in folder.iter_files()]
 
     @property
     def all_important_infos(self) -> str:
@@ -86,44 +172,100 @@ class Employee:
         infos += f"General instructions for interacting with the agent: \n\n{self.formated_instructions}"
         return infos
 
+    def pending_conditions(self) -> list[Condition]:
+        """The conditions `choose_actions` would evaluate, in the current state."""
+        return [
+            preplanned_action.condition
+            for preplanned_action in self.preplanned_actions.values()
+            if not (
+                preplanned_action.is_completed
+                and not preplanned_action.stays_after_completion
+            )
+            and preplanned_action.requirements_met
+        ]
+
     def choose_actions(self) -> list[Action]:
         actions: list[Action] = []
         for id, preplanned_action in self.preplanned_actions.items():
-            all_requirements_completed = True
-            for required_completed_actions in preplanned_action.requires_completion:
-                if not required_completed_actions.is_completed:
-                    all_requirements_completed = False
-                    break
-            if not all_requirements_completed:
+            if (
+                preplanned_action.is_completed
+                and not preplanned_action.stays_after_completion
+            ):
+                continue
+            if not preplanned_action.requirements_met:
                 continue
 
+            condition_is_true = preplanned_action.condition.is_true()
             if hasattr(self, "env") and os.environ["LOG_CONDITIONS"] == "True":
+                # The trace reuses the computed values, conditions aren't evaluated twice
                 self.env.add_log(
                     "preplanned_action_cond",
                     self.name,
-                    preplanned_action.condition._evaluate(),
+                    preplanned_action.condition.trace(),
                 )
-            if (
-                not preplanned_action.is_completed
-                or preplanned_action.stays_after_completion
-            ) and preplanned_action.condition.is_true():
+            if condition_is_true:
                 actions.append(preplanned_action.linked_action)
                 preplanned_action.is_completed = True
         return actions
 
+    def snapshot(self) -> EmployeeSnapshot:
+        # Lists the employees only append to are restored by truncation
+        preplanned_actions = self.preplanned_actions.values()
+        return EmployeeSnapshot(
+            email_box=self._email_box.snapshot() if self._email_box else None,
+            folders=len(self.folders),
+            actions=len(self.actions),
+            known_facts=len(self.known_facts),
+            instructions=len(self.instructions),
+            preplanned_actions=dict(self.preplanned_actions),
+            completed=tuple(action.is_completed for action in preplanned_actions),
+            requirements_met=tuple(
+                action._requirements_met for action in preplanned_actions
+            ),
+            requirements={
+                key: tuple(action.requires_completion)
+                for key, action in self.preplanned_actions.items()
+                if action.requires_completion
+            }
+            or None,
+        )
+
+    def restore(self, snapshot: EmployeeSnapshot) -> None:
+        if snapshot.email_box:
+            self.email_box.restore(snapshot.email_box)
+        elif self._email_box:
+            # Emptied rather than dropped, so that the mailbox versions keep increasing
+            self._email_box.restore(MailboxSnapshot(0, 0))
+        del self.folders[snapshot.folders :]
+        del self.actions[snapshot.actions :]
+        del self.known_facts[snapshot.known_facts :]
+        del self.instructions[snapshot.instructions :]
+        self.preplanned_actions = dict(snapshot.preplanned_actions)
+        for (key, action), completed, requirements_met in zip(
+            snapshot.preplanned_actions.items(),
+            snapshot.completed,
+            snapshot.requirements_met,
+        ):
+            action.is_completed = completed
+            action._requirements_met = requirements_met
+            action.requires_completion[:] = (snapshot.requirements or {}).get(key, ())
+
     def execute_action(self, action: Action):
         action.source = self
-        action.execute(self.env)
+        with profiler.span(f"execute_action:{action.__class__.__name__}"):
+            action.execute(self.env)
         self.actions.append(action)
 
     @property
     def contacts(self):
         return list(self.contacts_map.values())
 
-    def list_available_files(self) -> str:
+    def list_available_files(
+        self, max_depth: Optional[int] = None, max_entries: Optional[int] = None
+    ) -> str:
         all_trees = ""
         for folder in self.folders:
-            all_trees += folder.tree() + "\n"
+            all_trees += folder.tree(max_depth=max_depth, max_entries=max_entries) + "\n"
         return all_trees
 
     def __repr__(self) -> str:
@@ -1,21 +1,34 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
 import json
 import os
-from typing import Any
+from typing import Any, Iterator, Optional
 from workspace_for_agents.actions import (
+    Action,
     CheckMailBox,
     DisplayContacts,
     DisplayFiles,
     ReadMail,
     ReadMarkdownFile,
     ReadPDFPage,
+    SearchFiles,
     SendEmail,
     SetTaskAsCompleted,
     Wait,
 )
 from workspace_for_agents.task import Task
 from workspace_for_agents.agent import Agent, GPTAgent, HumanAgent
-from workspace_for_agents.employee import Employee
+from workspace_for_agents.bundle import is_bundle, load_bundle
+from workspace_for_agents.directory import EmployeeDirectory
+from workspace_for_agents.employee import Employee, EmployeeSnapshot
+from workspace_for_agents.file_system import FileTreeIndex
+from workspace_for_agents.log_writer import JSONLinesLogWriter
+from workspace_for_agents.mail import EmailIdAllocator
+from workspace_for_agents.profiling import get_profiler, save_report
+from workspace_for_agents.utils import batch_semantic_checks
 
 
 @dataclass
@@ -35,19 +48,65 @@ class Log:
         }
 
 
+@dataclass
+class EnvironmentSnapshot:
+    turn: int
+    current_states: list[str]
+    next_email_id: int
+    logs: int
+    n_employees: int
+    # The agent's snapshot comes first
+    employees: list[tuple[Employee, EmployeeSnapshot]]
+
+
 class Environment:
-    def __init__(self, agent: Agent, employees: list[Employee] = []) -> None:
-        self.employees = employees
+    def __init__(
+        self,
+        agent: Agent,
+        employees: Optional[list[Employee]] = None,
+        file_index: Optional[FileTreeIndex] = None,
+    ) -> None:
+        self.employees = employees or []
+        self.file_index = file_index if file_index else FileTreeIndex()
         for employee in self.employees:
             employee.env = self
         self.agent = agent
         self.agent.env = self
         self.current_turn = 0
         self.current_states: list[str] = ["<default>"]
+        # Per-environment ids, so that mailboxes are identical from a run to another
+        self.email_ids = EmailIdAllocator()
         self.logs: list[Log] = []
+        self.log_writer: Optional[JSONLinesLogWriter] = None
+        # Dynamic mails are generated on first read, unless prefetched
+        self.prefetch_dynamic_mails = False
+        # Semantic checks of a phase are resolved with a few batched requests
+        self.batch_semantic_checks = False
+        self.profile: Optional[dict[str, Any]] = None
+        self.turn_seconds: list[float] = []
+
+    @property
+    def employees(self) -> list[Employee]:
+        return self._employees
+
+    @employees.setter
+    def employees(self, employees: list[Employee]) -> None:
+        if getattr(self, "directory", None) is not None:
+            self.directory.detach()
+        # A copy: add_employee() and restore() modify the list in place
+        self._employees = list(employees)
+        self.directory = EmployeeDirectory(self._employees)
+
+    def add_employee(self, employee: Employee) -> None:
+        employee.env = self
+        self._employees.append(employee)
+        self.directory.add(employee)
 
     def add_log(self, log_type: str, emitted_by: str, content: dict[str, Any]):
-        self.logs.append(Log(log_type, self.current_turn, emitted_by, content))
+        log = Log(log_type, self.current_turn, emitted_by, content)
+        self.logs.append(log)
+        if self.log_writer:
+            self.log_writer.write(log.json)
 
     def save_logs(self, path: str):
         with open(path, "w", encoding="utf-8") as f:
@@ -57,33 +116,34 @@ class Environment:
         employee.known_facts.append(fact)
 
     def get_employees_by_tag(self, tags: list[str]) -> list[Employee]:
-        employees = []
-        for employee in self.employees:
-            for tag in employee.tags:
-                if tag.lower() in [tag.lower() for tag in tags]:
-                    employees.append(employee)
-                    break
-        return employees
+        return self.directory.with_tags(tags)
 
-    def get_employee_by_name(self, name: str) -> Employee:
-        for employee in self.employees:
-            if employee.name == name:
-                return employee
+    def get_employee_by_id(self, employee_id: int) -> Employee:
+        employee = self.directory.get_by_id(employee_id)
+        if employee is None:
+            raise KeyError(
+                f"Couldn't find {employee_id} when calling Environment.get_employee_by_id()"
+            )
+        return employee
 
-        raise KeyError(
-            f"Couldn't find {name} when calling Environment.get_employee_by_name()"
-        )
+    def get_employee_by_name(self, name: str) -> Employee:
+        employee = self.directory.get_by_name(name)
+        if employee is None:
+            raise KeyError(
+                f"Couldn't find {name} when calling Environment.get_employee_by_name()"
+            )
+        return employee
 
     def get_employee_by_email(self, email: str) -> Employee:
         if email == self.agent.email:
             return self.agent
 
-        for employee in self.employees:
-            if employee.email == email:
-                return employee
-        raise KeyError(
-            f"Couldn't find {email} when calling Environment.get_employee_by_email()"
-        )
+        employee = self.directory.get_by_email(email)
+        if employee is None:
+            raise KeyError(
+                f"Couldn't find {email} when calling Environment.get_employee_by_email()"
+            )
+        return employee
 
     def display_relationships_graph(self):
         """Displays a graph visualization of employee relationships using networkx and matplotlib"""
@@ -128,13 +188,182 @@ class Environment:
         plt.axis("off")
         plt.show()
 
-    def run_task(self, task: Task, max_turns: int = 100) -> None:
+    def snapshot(self) -> EnvironmentSnapshot:
+        """
+        Captures the state of the episode: turn, mailboxes, preplanned actions
+        completion, agent history and downloads. Mails, file trees, profiles and
+        the contact graph are shared with the snapshot rather than copied, and
+        mailboxes are only copied if they are modified otherwise than by new mails.
+        """
+        return EnvironmentSnapshot(
+            turn=self.current_turn,
+            current_states=list(self.current_states),
+            next_email_id=self.email_ids.snapshot(),
+            logs=len(self.logs),
+            n_employees=len(self.employees),
+            employees=[
+                (employee, employee.snapshot())
+                for employee in [self.agent, *self.employees]
+            ],
+        )
+
+    def restore(self, snapshot: EnvironmentSnapshot) -> None:
+        """Puts the episode back in the state of `snapshot`, which can be restored again later."""
+        self.current_turn = snapshot.turn
+        self.current_states = list(snapshot.current_states)
+        self.email_ids.restore(snapshot.next_email_id)
+        del self.logs[snapshot.logs :]
+        for employee in self._employees[snapshot.n_employees :]:
+            self.directory.remove(employee)
+        del self._employees[snapshot.n_employees :]
+        for employee, employee_snapshot in snapshot.employees:
+            employee.restore(employee_snapshot)
+
+    @contextmanager
+    def fork(
+        self, snapshot: Optional[EnvironmentSnapshot] = None
+    ) -> Iterator[EnvironmentSnapshot]:
+        """
+        Runs a branch of the episode from `snapshot` (by default, the current
+        state), and restores it when leaving the context, e.g. to compare
+        several agents or prompts from a common checkpoint:
+
+            checkpoint = env.snapshot()
+            for agent in agents:
+                with env.fork(checkpoint):
+                    ...
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        else:
+            self.restore(snapshot)
+        try:
+            yield snapshot
+        finally:
+            self.restore(snapshot)
+
+    def run_task(
+        self,
+        task: Task,
+        max_turns: int = 100,
+        employee_workers: int = 1,
+        logs_path: str = "logs.json",
+        profile_path: Optional[str] = None,
+        reset_turn: bool = True,
+    ) -> dict[str, float]:
+        """
+        Runs the task until completion or until `max_turns` is reached, and
+        returns the score of each completion goal.
+
+        When the `LOGS` environment variable is set, logs are streamed to a
+        JSON Lines file next to `logs_path`, and exported to `logs_path` at
+        the end of the run.
+
+        With `employee_workers` > 1, every employee's preplanned conditions are
+        evaluated concurrently at the start of the employees' phase, and the
+        resulting actions are then executed sequentially in employee order. In
+        that mode, employees all see the state as it was at the end of the
+        agent's phase, rather than the actions of the employees before them.
+
+        With `profile_path` (or when profiling is enabled with the `PROFILE`
+        environment variable), the time spent in the agent, the employees,
+        the conditions, the LLM calls, etc. is measured and the resulting
+        report is stored in `self.profile`, and saved to `profile_path` (JSON,
+        plus a `.folded` flame graph file).
+
+        With `reset_turn=False`, the episode can be continued from where it
+        stopped, e.g. after taking a `snapshot()`.
+        """
         self.agent.header = f"High-level objective: {task.task_goal}"
-        task_ongoing = True
+        profiler = get_profiler()
+        # Only profiles this run, the setting is restored afterwards
+        was_enabled = profiler.enabled
+        if profile_path:
+            profiler.enabled = True
+        try:
+            if profiler.enabled:
+                profiler.reset()
+            self.turn_seconds = []
+            if os.getenv("LOGS"):
+                self.log_writer = JSONLinesLogWriter(
+                    os.path.splitext(logs_path)[0] + ".jsonl"
+                )
+                for log in self.logs:
+                    self.log_writer.write(log.json)
+            executor = (
+                ThreadPoolExecutor(max_workers=employee_workers)
+                if employee_workers > 1
+                else None
+            )
+            try:
+                self._run_turns(task, max_turns, executor)
+            finally:
+                if executor:
+                    executor.shutdown()
+                if self.log_writer:
+                    self.log_writer.export_json(logs_path)
+                    self.log_writer = None
+
+            if profiler.enabled:
+                self.profile = profiler.report()
+                self.profile["turn_seconds"] = self.turn_seconds
+                if profile_path:
+                    save_report(self.profile, profile_path)
+        finally:
+            profiler.enabled = was_enabled
+
+        if self.batch_semantic_checks:
+            batch_semantic_checks(lambda: [goal.score for goal in task.completion_goals])
+        scores: dict[str, float] = {}
+        for goal in task.completion_goals:
+            scores[goal.name] = goal.score
+            print(f"{goal.name}: {scores[goal.name]}")
+        if reset_turn:
+            self.current_turn = 0
+        return scores
+
+    def _choose_employees_actions(
+        self, executor: ThreadPoolExecutor
+    ) -> list[list[Action]]:
+        # Each employee runs in a copy of the current context, so that its
+        # profiling spans are attached to the current turn
+        contexts = [contextvars.copy_context() for _ in self.employees]
+        # map() preserves the employees order, whatever the completion order
+        return list(
+            executor.map(
+                lambda context, employee: context.run(self._choose_actions, employee),
+                contexts,
+                self.employees,
+            )
+        )
+
+    def _choose_actions(self, employee: Employee) -> list[Action]:
+        with get_profiler().span("employee.choose_actions"):
+            return employee.choose_actions()
+
+    def _run_turns(
+        self, task: Task, max_turns: int, executor: Optional[ThreadPoolExecutor]
+    ) -> None:
+        profiler = get_profiler()
         for turn in range(max_turns):
+            turn_start = time.perf_counter()
+            with profiler.span("turn"):
+                task_ongoing = self._run_turn(task, executor)
+            self.turn_seconds.append(time.perf_counter() - turn_start)
+            if task_ongoing == False:
+                break
+
+            self.current_turn += 1
+
+    def _run_turn(self, task: Task, executor: Optional[ThreadPoolExecutor]) -> bool:
+        """Runs the agent's phase, then the employees' one. Returns whether the task is still ongoing."""
+        profiler = get_profiler()
+        task_ongoing = True
+        with profiler.span("agent_phase"):
             action = None
             while not isinstance(action, Wait) and task_ongoing:
-                action = self.agent.choose_action()
+                with profiler.span("agent.choose_action"):
+                    action = self.agent.choose_action()
                 self.agent.execute_action(action)
                 if os.environ["LOG_ACTIONS"] == "True":
                     self.add_log(
@@ -146,15 +375,28 @@ class Environment:
                         },
                     )
 
-                if os.getenv("LOGS"):
-                    self.save_logs(path="logs.json")
-
                 if isinstance(action, SetTaskAsCompleted):
                     task_ongoing = False
-            if task_ongoing == False:
-                break
-            for employee in self.employees:
-                actions = employee.choose_actions()
+        if task_ongoing == False:
+            return False
+
+        with profiler.span("employees_phase"):
+            if self.batch_semantic_checks:
+                batch_semantic_checks(
+                    lambda: [
+                        condition.is_true()
+                        for employee in self.employees
+                        for condition in employee.pending_conditions()
+                    ]
+                )
+            chosen_actions = (
+                self._choose_employees_actions(executor) if executor else None
+            )
+            for i, employee in enumerate(self.employees):
+                if chosen_actions is not None:
+                    actions = chosen_actions[i]
+                else:
+                    actions = self._choose_actions(employee)
                 for action in actions:
                     employee.execute_action(action)
                     if os.environ["LOG_ACTIONS"] == "True":
@@ -166,27 +408,20 @@ class Environment:
                                 "content": action.json,
                             },
                         )
-                    if os.getenv("LOGS"):
-                        self.save_logs(path="logs.json")
                     if isinstance(action, SetTaskAsCompleted):
                         task_ongoing = False
                         break
 
-            for goal in task.completion_goals:
-                if goal.score == 1 and goal.triggers_completion:
-                    task_ongoing = False
-
-            if task_ongoing == False:
-                break
-
-            self.current_turn += 1
-
+        if self.batch_semantic_checks:
+            batch_semantic_checks(lambda: [goal.score for goal in task.completion_goals])
         for goal in task.completion_goals:
-            print(f"{goal.name}: {goal.score}")
-        self.current_turn = 0
+            if goal.score == 1 and goal.triggers_completion:
+                task_ongoing = False
+
+        return task_ongoing
 
 
-def create_environnement_from_file(file_path: str) -> Environment:
+def _load_employees(file_path: str) -> tuple[list[Employee], FileTreeIndex]:
     with open(file_path, "r", encoding="utf-8") as f:
         env_data = json.load(f)
 
@@ -206,11 +441,25 @@ def create_environnement_from_file(file_path: str) -> Environment:
         for contact_id in employee_info["contacts_ids"]:
             employee.add_contact(employees[contact_id])
 
+    file_index = FileTreeIndex()
     for folder in env_data["folders"]:
         for employee_id in folder["has_access"]:
-            employees[employee_id].add_files_from_folder(folder["path"])
-
-    match os.environ["AGENT_TYPE"]:
+            employees[employee_id].add_files_from_folder(folder["path"], file_index)
+    return list(employees.values()), file_index
+
+
+def create_environnement_from_file(
+    file_path: str, agent_type: Optional[str] = None
+) -> Environment:
+    """`file_path` is either an environment JSON file, or a bundle compiled from it."""
+    if is_bundle(file_path):
+        employees, file_index = load_bundle(file_path)
+    else:
+        employees, file_index = _load_employees(file_path)
+
+    if agent_type is None:
+        agent_type = os.environ["AGENT_TYPE"]
+    match agent_type:
         case "human":
             Agent = HumanAgent
         case "gpt":
@@ -226,9 +475,12 @@ def create_environnement_from_file(file_path: str) -> Environment:
             DisplayFiles,
             ReadPDFPage,
             ReadMarkdownFile,
+            SearchFiles,
             Wait,
             SetTaskAsCompleted,
         ]
     )
-    env = Environment(agent=agent, employees=list(employees.values()))
+    env = Environment(
+        agent=agent, employees=employees, file_index=file_index
+    )
     return env
@@ -1,5 +1,5 @@
 import os
-from typing import Optional, Self
+from typing import Iterator, Optional, Self
 
 
 class File:
@@ -17,30 +17,106 @@ class Folder:
         self.name = name
         self.files: list[File] = []
         self.subfolders: list[Folder] = []
+        self.frozen = False
+        self._parents: list[Folder] = []
+        self._tree_cache: dict[tuple, str] = {}
 
     def add_file(self, file: File):
+        self._check_not_frozen()
         self.files.append(file)
+        self._invalidate_tree()
 
     def add_subfolder(self, folder: Self):
+        self._check_not_frozen()
         self.subfolders.append(folder)
-
-    def tree(self, indent: str = "") -> str:
-        """Returns a string representation of the folder structure in tree format"""
+        folder._parents.append(self)
+        self._invalidate_tree()
+
+    def _check_not_frozen(self):
+        if self.frozen:
+            raise RuntimeError(
+                f"{self.path} is shared between employees and cannot be modified."
+            )
+
+    def freeze(self) -> Self:
+        """Makes the whole tree read-only, so that it can be safely shared."""
+        self.frozen = True
+        for subfolder in self.subfolders:
+            subfolder.freeze()
+        return self
+
+    def iter_files(self) -> Iterator[File]:
+        yield from self.files
+        for subfolder in self.subfolders:
+            yield from subfolder.iter_files()
+
+    def get_subfolder(self, relative_path: str) -> Optional[Self]:
+        """Returns the subfolder at `relative_path` (e.g. "a/b"), if it exists."""
+        folder = self
+        for name in [part for part in relative_path.split("/") if part]:
+            folder = next((f for f in folder.subfolders if f.name == name), None)
+            if folder is None:
+                return None
+        return folder
+
+    def _invalidate_tree(self):
+        self._tree_cache.clear()
+        for parent in self._parents:
+            parent._invalidate_tree()
+
+    def tree(
+        self,
+        indent: str = "",
+        max_depth: Optional[int] = None,
+        max_entries: Optional[int] = None,
+    ) -> str:
+        """
+        Returns a string representation of the folder structure in tree format.
+        Folders deeper than `max_depth` are collapsed, and only the first
+        `max_entries` files of each folder are listed. Renderings are cached
+        until the folder, or one of its subfolders, is modified.
+        """
+        key = (indent, max_depth, max_entries)
+        if key not in self._tree_cache:
+            self._tree_cache[key] = self._render_tree(indent, max_depth, max_entries)
+        return self._tree_cache[key]
+
+    def _render_tree(
+        self, indent: str, max_depth: Optional[int], max_entries: Optional[int]
+    ) -> str:
         result = [f"{indent}{self.name}/"]
-
-        for i, file in enumerate(sorted(self.files, key=lambda f: f.name)):
+        if max_depth == 0:
+            if self.files or self.subfolders:
+                result[0] += f" ({len(self.files)} files, {len(self.subfolders)} subfolders, not shown)"
+            return result[0]
+
+        files = sorted(self.files, key=lambda f: f.name)
+        hidden_files = 0
+        if max_entries is not None and len(files) > max_entries:
+            hidden_files = len(files) - max_entries
+            files = files[:max_entries]
+
+        for i, file in enumerate(files):
             is_last_file = (i == len(self.files) - 1) and len(self.subfolders) == 0
             if is_last_file:
                 result.append(f"{indent}└── {file.name}")
             else:
                 result.append(f"{indent}├── {file.name}")
+        if hidden_files:
+            connector = "└──" if len(self.subfolders) == 0 else "├──"
+            result.append(f"{indent}{connector} ... ({hidden_files} more files)")
 
+        subfolders_depth = None if max_depth is None else max_depth - 1
         for i, subfolder in enumerate(sorted(self.subfolders, key=lambda f: f.name)):
             is_last = i == len(self.subfolders) - 1
             if is_last:
-                result.append(subfolder.tree(indent + "    "))
+                result.append(
+                    subfolder.tree(indent + "    ", subfolders_depth, max_entries)
+                )
             else:
-                result.append(subfolder.tree(indent + "│   "))
+                result.append(
+                    subfolder.tree(indent + "│   ", subfolders_depth, max_entries)
+                )
 
         return "\n".join(result)
 
@@ -98,3 +174,23 @@ def create_folder_structure(path: str) -> Optional[Folder]:
     except Exception as e:
         print(f"Error processing {path}: {str(e)}")
         return None
+
+
+class FileTreeIndex:
+    """
+    Scans each folder root only once. The resulting trees are frozen and
+    shared by every employee who has access to them.
+    """
+
+    def __init__(self) -> None:
+        self._trees: dict[str, Folder] = {}
+
+    def get(self, path: str) -> Folder:
+        key = os.path.normpath(path)
+        if key not in self._trees:
+            folder = create_folder_structure(path)
+            if folder is None:
+                # Missing folders are still listed, as empty folders
+                folder = Folder(path, os.path.basename(path))
+            self._trees[key] = folder.freeze()
+        return self._trees[key]
@@ -1,5 +1,545 @@
+import asyncio
+import json
 import os
-from openai import OpenAI
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from types import SimpleNamespace
+from typing import Any, Callable, Optional
 
+from pydantic import BaseModel
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from workspace_for_agents.cache import hash_key
+from workspace_for_agents.profiling import profiler
+
+
+class TokenBucket:
+    """Thread-safe token bucket, refilled at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Takes a token and returns how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last_refill) * self.rate
+            )
+            self._last_refill = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self) -> None:
+        wait_time = self._reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    async def acquire_async(self) -> None:
+        wait_time = self._reserve()
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+
+def make_completion(
+    content: Optional[str],
+    parsed: Optional[BaseModel] = None,
+    usage: Optional[dict[str, int]] = None,
+) -> SimpleNamespace:
+    """Builds an object shaped like the OpenAI chat completions responses."""
+    usage = usage or {}
+    return SimpleNamespace(
+        choices=[
+            SimpleNamespace(message=SimpleNamespace(content=content, parsed=parsed))
+        ],
+        usage=SimpleNamespace(
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            prompt_tokens_details=SimpleNamespace(
+                cached_tokens=usage.get("cached_tokens", 0)
+            ),
+        ),
+    )
+
+
+def completion_usage(completion: Any) -> dict[str, int]:
+    """Token counts of a completion, including the prompt tokens served from the provider cache."""
+    usage = getattr(completion, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+    }
+
+
+class LLMClient(ABC):
+    """
+    Backend-agnostic chat client. Every request goes through a cap on the
+    number of in-flight requests, an optional token-bucket rate limiter and
+    a retry loop with exponential backoff on rate-limit errors.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        requests_per_minute: Optional[float] = None,
+        max_retries: int = 5,
+        base_backoff: float = 1.0,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.rate_limiter: Optional[TokenBucket] = (
+            TokenBucket(requests_per_minute / 60) if requests_per_minute else None
+        )
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._async_semaphores: dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = (
+            {}
+        )
+        # Token usage of every successful request, see usage_summary()
+        self.usage_records: list[dict[str, Any]] = []
+        self._usage_lock = threading.Lock()
+
+    @abstractmethod
+    def _parse(
+        self, model: str, messages: list[dict], response_format: type[BaseModel], **kwargs
+    ) -> Any:
+        pass
+
+    @abstractmethod
+    def _create(self, model: str, messages: list[dict], **kwargs) -> Any:
+        pass
+
+    async def _aparse(
+        self, model: str, messages: list[dict], response_format: type[BaseModel], **kwargs
+    ) -> Any:
+        return await asyncio.to_thread(
+            self._parse, model, messages, response_format, **kwargs
+        )
+
+    async def _acreate(self, model: str, messages: list[dict], **kwargs) -> Any:
+        return await asyncio.to_thread(self._create, model, messages, **kwargs)
+
+    def is_rate_limit_error(self, error: Exception) -> bool:
+        return False
+
+    def retry_delay(self, error: Exception, attempt: int) -> float:
+        return self.base_backoff * 2**attempt * (1 + random.random() / 4)
+
+    def record_usage(self, model: str, completion: Any) -> dict[str, Any]:
+        record = {"model": model, **completion_usage(completion)}
+        with self._usage_lock:
+            self.usage_records.append(record)
+        profiler.add_usage(record)
+        return record
+
+    def usage_summary(self) -> dict[str, Any]:
+        with self._usage_lock:
+            records = list(self.usage_records)
+        prompt_tokens = sum(record["prompt_tokens"] for record in records)
+        cached_tokens = sum(record["cached_tokens"] for record in records)
+        return {
+            "requests": len(records),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": sum(record["completion_tokens"] for record in records),
+            "cached_tokens": cached_tokens,
+            "cache_hit_rate": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        }
+
+    def parse(
+        self, model: str, messages: list[dict], response_format: type[BaseModel], **kwargs
+    ) -> Any:
+        return self._call(self._parse, model, messages, response_format, **kwargs)
+
+    def create(self, model: str, messages: list[dict], **kwargs) -> Any:
+        return self._call(self._create, model, messages, **kwargs)
+
+    async def aparse(
+        self, model: str, messages: list[dict], response_format: type[BaseModel], **kwargs
+    ) -> Any:
+        return await self._acall(self._aparse, model, messages, response_format, **kwargs)
+
+    async def acreate(self, model: str, messages: list[dict], **kwargs) -> Any:
+        return await self._acall(self._acreate, model, messages, **kwargs)
+
+    def _call(self, request: Callable, *args, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            with self._semaphore:
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                try:
+                    with profiler.span(f"llm:{args[0]}"):
+                        completion = request(*args, **kwargs)
+                        self.record_usage(args[0], completion)
+                    return completion
+                except Exception as e:
+                    if not self.is_rate_limit_error(e) or attempt >= self.max_retries:
+                        raise
+                    delay = self.retry_delay(e, attempt)
+            # Sleeping outside of the semaphore frees the slot for other requests
+            time.sleep(delay)
+            attempt += 1
+
+    async def _acall(self, request: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_semaphores:
+            self._async_semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        semaphore = self._async_semaphores[loop]
+        attempt = 0
+        while True:
+            async with semaphore:
+                if self.rate_limiter:
+                    await self.rate_limiter.acquire_async()
+                try:
+                    with profiler.span(f"llm:{args[0]}"):
+                        completion = await request(*args, **kwargs)
+                        self.record_usage(args[0], completion)
+                    return completion
+                except Exception as e:
+                    if not self.is_rate_limit_error(e) or attempt >= self.max_retries:
+                        raise
+                    delay = self.retry_delay(e, attempt)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+class OpenAIClient(LLMClient):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_connections: int = 32,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        import httpx
+        from openai import OpenAI, DefaultHttpxClient
+
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        # Retries are handled by LLMClient, so the SDK ones are disabled
+        self._client = OpenAI(
+            api_key=self.api_key,
+            http_client=DefaultHttpxClient(limits=self.limits),
+            max_retries=0,
+        )
+        self._async_client = None
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                http_client=DefaultAsyncHttpxClient(limits=self.limits),
+                max_retries=0,
+            )
+        return self._async_client
+
+    def _parse(self, model, messages, response_format, **kwargs):
+        return self._client.beta.chat.completions.parse(
+            model=model, messages=messages, response_format=response_format, **kwargs
+        )
+
+    def _create(self, model, messages, **kwargs):
+        return self._client.chat.completions.create(
+            model=model, messages=messages, **kwargs
+        )
+
+    async def _aparse(self, model, messages, response_format, **kwargs):
+        return await self.async_client.beta.chat.completions.parse(
+            model=model, messages=messages, response_format=response_format, **kwargs
+        )
+
+    async def _acreate(self, model, messages, **kwargs):
+        return await self.async_client.chat.completions.create(
+            model=model, messages=messages, **kwargs
+        )
+
+    def is_rate_limit_error(self, error: Exception) -> bool:
+        from openai import RateLimitError
+
+        return isinstance(error, RateLimitError)
+
+    def retry_delay(self, error: Exception, attempt: int) -> float:
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return super().retry_delay(error, attempt)
+
+
+def _placeholder_instance(response_format: type[BaseModel]) -> BaseModel:
+    values = {}
+    for name, field in response_format.model_fields.items():
+        if field.annotation is bool:
+            values[name] = False
+        elif field.annotation in (int, float):
+            values[name] = field.annotation(0)
+        elif field.annotation is str:
+            values[name] = ""
+        else:
+            values[name] = None
+    return response_format.model_construct(**values)
+
+
+def _common_prefix_length(a: str, b: str) -> int:
+    length = 0
+    for char_a, char_b in zip(a, b):
+        if char_a != char_b:
+            break
+        length += 1
+    return length
+
+
+class FakeLLMClient(LLMClient):
+    """
+    Offline backend. `responder(model, messages, response_format)` returns
+    either the text of the answer or, for structured outputs, an instance of
+    `response_format` (or its JSON). Without responder, placeholder answers
+    are returned.
+
+    Usage is estimated (~4 characters per token), and prompt caching is
+    simulated like OpenAI's: the prefix shared with the previous request to
+    the same model is cached by blocks of 128 tokens, from 1024 tokens on.
+    """
+
+    def __init__(
+        self,
+        responder: Optional[
+            Callable[[str, list[dict], Optional[type[BaseModel]]], str | BaseModel]
+        ] = None,
+        latency: float = 0.0,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.responder = responder
+        self.latency = latency
+        self.requests: list[dict[str, Any]] = []
+        self._last_prompts: dict[str, str] = {}
+
+    def _usage(self, model, messages, answer: str) -> dict[str, int]:
+        prompt = "".join(f"<{m['role']}>{m['content']}" for m in messages)
+        with self._usage_lock:
+            shared = _common_prefix_length(prompt, self._last_prompts.get(model, ""))
+            self._last_prompts[model] = prompt
+        cached_tokens = shared // 4 // 128 * 128
+        return {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(answer) // 4,
+            "cached_tokens": cached_tokens if cached_tokens >= 1024 else 0,
+        }
+
+    def _respond(self, model, messages, response_format):
+        self.requests.append(
+            {"model": model, "messages": messages, "response_format": response_format}
+        )
+        if self.latency:
+            time.sleep(self.latency)
+        if self.responder:
+            return self.responder(model, messages, response_format)
+        if response_format:
+            return _placeholder_instance(response_format)
+        return "This is a placeholder answer."
+
+    def _parse(self, model, messages, response_format, **kwargs):
+        answer = self._respond(model, messages, response_format)
+        if isinstance(answer, str):
+            answer = response_format.model_validate_json(answer)
+        content = answer.model_dump_json()
+        return make_completion(
+            content, parsed=answer, usage=self._usage(model, messages, content)
+        )
+
+    def _create(self, model, messages, **kwargs):
+        content = self._respond(model, messages, None)
+        return make_completion(content, usage=self._usage(model, messages, content))
+
+
+class CassetteMissError(KeyError):
+    pass
+
+
+class RecordReplayClient(LLMClient):
+    """
+    Stores every request/response pair in a JSON Lines cassette, keyed by a
+    hash of the normalized request, and serves them back without network:
+
+    - "record": calls `client` and overwrites the cassette
+    - "replay": only serves recorded responses, raises CassetteMissError otherwise
+    - "auto": serves recorded responses, and records the missing ones
+
+    Identical requests are answered with their responses in recording order
+    (the last one is reused once they are exhausted, in "replay" mode).
+    """
+
+    MODES = ("record", "replay", "auto")
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "replay",
+        client: Optional[LLMClient] = None,
+        **kwargs,
+    ) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}, expected one of {self.MODES}")
+        kwargs.setdefault("max_concurrency", 64)
+        super().__init__(**kwargs)
+        self.path = path
+        self.mode = mode
+        self._client = client
+        self._lock = threading.Lock()
+        self._responses: dict[str, list[dict[str, Any]]] = {}
+        self._served: dict[str, int] = {}
+
+        if mode == "record" or not os.path.exists(path):
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w", encoding="utf-8").close()
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._responses.setdefault(entry["key"], []).append(entry)
+
+    @property
+    def client(self) -> LLMClient:
+        if self._client is None:
+            if self.mode == "replay":
+                raise RuntimeError("No client is used in replay mode.")
+            self._client = _default_client()
+        return self._client
+
+    @staticmethod
+    def normalize_request(
+        model: str,
+        messages: list[dict],
+        response_format: Optional[type[BaseModel]] = None,
+        **kwargs,
+    ) -> dict[str, Any]:
+        return {
+            "model": model,
+            "messages": [
+                {"role": message["role"], "content": str(message["content"]).strip()}
+                for message in messages
+            ],
+            "response_format": (
+                response_format.model_json_schema() if response_format else None
+            ),
+            "kwargs": {key: kwargs[key] for key in sorted(kwargs) if key != "timeout"},
+        }
+
+    def request_key(self, request: dict[str, Any]) -> str:
+        return hash_key(json.dumps(request, sort_keys=True, ensure_ascii=False))
+
+    def _recorded(self, key: str) -> Optional[dict[str, Any]]:
+        with self._lock:
+            responses = self._responses.get(key)
+            if not responses:
+                return None
+            served = self._served.get(key, 0)
+            if served >= len(responses):
+                if self.mode == "auto":
+                    return None
+                served = len(responses) - 1
+            self._served[key] = served + 1
+            return responses[served]
+
+    def _record(self, key: str, request: dict[str, Any], completion: Any) -> None:
+        entry = {
+            "key": key,
+            "request": request,
+            "content": completion.choices[0].message.content,
+            "usage": completion_usage(completion),
+        }
+        with self._lock:
+            self._responses.setdefault(key, []).append(entry)
+            self._served[key] = self._served.get(key, 0) + 1
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _serve(self, send: Callable[[], Any], request: dict[str, Any], response_format):
+        key = self.request_key(request)
+        entry = None if self.mode == "record" else self._recorded(key)
+        if entry is None:
+            if self.mode == "replay":
+                raise CassetteMissError(
+                    f"No recorded response for the {request['model']} request {key[:12]}"
+                )
+            completion = send()
+            self._record(key, request, completion)
+            return completion
+
+        parsed = (
+            response_format.model_validate_json(entry["content"])
+            if response_format
+            else None
+        )
+        return make_completion(entry["content"], parsed=parsed, usage=entry["usage"])
+
+    def _parse(self, model, messages, response_format, **kwargs):
+        request = self.normalize_request(model, messages, response_format, **kwargs)
+        return self._serve(
+            lambda: self.client.parse(model, messages, response_format, **kwargs),
+            request,
+            response_format,
+        )
+
+    def _create(self, model, messages, **kwargs):
+        request = self.normalize_request(model, messages, **kwargs)
+        return self._serve(
+            lambda: self.client.create(model, messages, **kwargs), request, None
+        )
+
+
+_client: Optional[LLMClient] = None
+_client_lock = threading.Lock()
+
+
+def _default_client() -> LLMClient:
+    requests_per_minute = os.getenv("LLM_REQUESTS_PER_MINUTE")
+    return OpenAIClient(
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        requests_per_minute=float(requests_per_minute) if requests_per_minute else None,
+    )
+
+
+def get_client() -> LLMClient:
+    """
+    Returns the shared client, created on first use: an OpenAI one, wrapped in
+    a RecordReplayClient when the `LLM_CASSETTE` environment variable is set.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            cassette_path = os.getenv("LLM_CASSETTE")
+            if cassette_path:
+                _client = RecordReplayClient(
+                    cassette_path, mode=os.getenv("LLM_CASSETTE_MODE", "replay")
+                )
+            else:
+                _client = _default_client()
+        return _client
+
+
+def set_client(client: LLMClient) -> None:
+    global _client
+    with _client_lock:
+        _client = client
@@ -0,0 +1,55 @@
+import json
+import threading
+from typing import Any
+
+from workspace_for_agents.profiling import profiled
+
+
+class JSONLinesLogWriter:
+    """
+    Append-only log sink: each log is serialized once, as a single JSON line,
+    and written to disk in buffered batches.
+    """
+
+    def __init__(self, path: str, batch_size: int = 32) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self._buffer: list[str] = []
+        self._lock = threading.Lock()
+        # Truncate any leftover file from a previous run
+        open(self.path, "w", encoding="utf-8").close()
+
+    @profiled("logs.write")
+    def write(self, log_json: dict[str, Any]) -> None:
+        line = json.dumps(log_json, ensure_ascii=False)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(self._buffer) + "\n")
+        self._buffer = []
+
+    def close(self) -> None:
+        self.flush()
+
+    @profiled("logs.export_json")
+    def export_json(self, path: str) -> None:
+        """Converts the JSON Lines file to the pretty JSON array format."""
+        self.flush()
+        jsonl_to_json(self.path, path)
+
+
+def jsonl_to_json(jsonl_path: str, json_path: str) -> None:
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        logs = [json.loads(line) for line in f if line.strip()]
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(logs, f, ensure_ascii=False, indent=4)
@@ -1,12 +1,253 @@
-from functools import cached_property
+import bisect
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, Optional
-from workspace_for_agents.llm_client import client
+from workspace_for_agents.llm_client import get_client
+from workspace_for_agents.profiling import profiled
+
+_prefetch_executor = ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix="email-prefetch"
+)
+
+
+class EmailIdAllocator:
+    """Hands out unique, monotonically increasing mail ids."""
+
+    def __init__(self, start: int = 1) -> None:
+        self._next_id = start
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            mail_id = self._next_id
+            self._next_id += 1
+            return mail_id
+
+    def snapshot(self) -> int:
+        with self._lock:
+            return self._next_id
+
+    def restore(self, next_id: int) -> None:
+        with self._lock:
+            self._next_id = next_id
+
+
+# Used for the mails created without an explicit id (e.g. outside of an Environment)
+_default_id_allocator = EmailIdAllocator()
+
+
+class MailIndex:
+    """Indexes of a list of mails: by id, sender, receiver and turn."""
+
+    def __init__(self) -> None:
+        self.by_id: dict[int, Email] = {}
+        self.by_sender: dict[str, list[Email]] = {}
+        self.by_receiver: dict[str, list[Email]] = {}
+        self.by_turn: dict[int, list[Email]] = {}
+        self.turns: list[int] = []
+        self.positions: dict[int, int] = {}
+
+    def add(self, email: "Email") -> None:
+        self.positions[id(email)] = len(self.positions)
+        self.by_id[email.id] = email
+        self.by_sender.setdefault(email.sender, []).append(email)
+        self.by_receiver.setdefault(email.receiver, []).append(email)
+        if email.turn not in self.by_turn:
+            self.by_turn[email.turn] = []
+            bisect.insort(self.turns, email.turn)
+        self.by_turn[email.turn].append(email)
+
+    def remove_last(self, emails: list["Email"]) -> None:
+        """Removes `emails`, which must be the last ones added, in any order."""
+        for email in sorted(emails, key=lambda email: self.positions[id(email)], reverse=True):
+            del self.positions[id(email)]
+            if self.by_id.get(email.id) is email:
+                del self.by_id[email.id]
+            for index, key in [
+                (self.by_sender, email.sender),
+                (self.by_receiver, email.receiver),
+                (self.by_turn, email.turn),
+            ]:
+                index[key].pop()
+                if not index[key]:
+                    del index[key]
+                    if index is self.by_turn:
+                        self.turns.remove(key)
+
+    def between_turns(
+        self, since_turn: Optional[int], until_turn: Optional[int]
+    ) -> list["Email"]:
+        start = 0 if since_turn is None else bisect.bisect_left(self.turns, since_turn)
+        end = (
+            len(self.turns)
+            if until_turn is None
+            else bisect.bisect_right(self.turns, until_turn)
+        )
+        emails = [email for turn in self.turns[start:end] for email in self.by_turn[turn]]
+        return sorted(emails, key=lambda email: self.positions[id(email)])
+
+
+class MailList(list):
+    """
+    A list of mails that keeps the indexes of its EmailBox up to date, so that
+    code appending to `received_emails` / `sent_emails` keeps working.
+    """
+
+    def __init__(self, email_box: "EmailBox", box: str) -> None:
+        super().__init__()
+        self._email_box = email_box
+        self._box = box
+
+    def append(self, email: "Email") -> None:
+        super().append(email)
+        self._email_box._added(self._box, email)
+
+    def extend(self, emails) -> None:
+        for email in emails:
+            self.append(email)
+
+    def _mutating(method_name: str):
+        def method(self, *args, **kwargs):
+            self._email_box._before_rewrite(self._box)
+            result = getattr(list, method_name)(self, *args, **kwargs)
+            self._email_box._reindex(self._box)
+            return result
+
+        return method
+
+    insert = _mutating("insert")
+    remove = _mutating("remove")
+    pop = _mutating("pop")
+    clear = _mutating("clear")
+    sort = _mutating("sort")
+    reverse = _mutating("reverse")
+    __setitem__ = _mutating("__setitem__")
+    __delitem__ = _mutating("__delitem__")
+    __iadd__ = _mutating("__iadd__")
+    del _mutating
+
+
+class MailboxSnapshot:
+    """
+    Copy-on-write state of an EmailBox: only the lengths of its lists are
+    recorded, as mails are appended. A list is copied the first time it is
+    modified otherwise after the snapshot.
+    """
+
+    __slots__ = ("lengths", "emails", "__weakref__")
+
+    def __init__(self, received: int, sent: int) -> None:
+        self.lengths = {"received": received, "sent": sent}
+        # Copies of the lists modified otherwise than by new mails
+        self.emails: dict[str, list[Email]] = {}
 
 
 class EmailBox:
     def __init__(self) -> None:
-        self.received_emails: list[Email] = []
-        self.sent_emails: list[Email] = []
+        self._indexes = {"received": MailIndex(), "sent": MailIndex()}
+        # Incremented on every change, so that conditions can tell when to re-evaluate
+        self.versions = {"received": 0, "sent": 0}
+        self._received_emails = MailList(self, "received")
+        self._sent_emails = MailList(self, "sent")
+        self._snapshots: weakref.WeakSet[MailboxSnapshot] = weakref.WeakSet()
+
+    @property
+    def received_emails(self) -> MailList:
+        return self._received_emails
+
+    @received_emails.setter
+    def received_emails(self, emails: list["Email"]) -> None:
+        self._received_emails[:] = emails
+
+    @property
+    def sent_emails(self) -> MailList:
+        return self._sent_emails
+
+    @sent_emails.setter
+    def sent_emails(self, emails: list["Email"]) -> None:
+        self._sent_emails[:] = emails
+
+    @property
+    def version(self) -> int:
+        return self.versions["received"] + self.versions["sent"]
+
+    def _added(self, box: str, email: "Email") -> None:
+        self._indexes[box].add(email)
+        self.versions[box] += 1
+
+    def _mails(self, box: str) -> MailList:
+        return self._received_emails if box == "received" else self._sent_emails
+
+    def _before_rewrite(self, box: str, kept: int = 0) -> None:
+        # Only the snapshots with mails beyond the `kept` first ones need a copy
+        for snapshot in self._snapshots:
+            if box not in snapshot.emails and snapshot.lengths[box] > kept:
+                snapshot.emails[box] = list(self._mails(box)[: snapshot.lengths[box]])
+
+    def snapshot(self) -> MailboxSnapshot:
+        snapshot = MailboxSnapshot(len(self._received_emails), len(self._sent_emails))
+        self._snapshots.add(snapshot)
+        return snapshot
+
+    def restore(self, snapshot: MailboxSnapshot) -> None:
+        for box, length in snapshot.lengths.items():
+            mails = self._mails(box)
+            if box in snapshot.emails:
+                self._before_rewrite(box)
+                list.__setitem__(mails, slice(None), snapshot.emails[box])
+                self._reindex(box)
+            elif len(mails) > length:
+                # Only appended since the snapshot: the new mails are dropped from the indexes
+                self._before_rewrite(box, kept=length)
+                self._indexes[box].remove_last(mails[length:])
+                list.__delitem__(mails, slice(length, None))
+                # Versions only increase, so that conditions never reuse a value from another branch
+                self.versions[box] += 1
+
+    def _reindex(self, box: str) -> None:
+        index = MailIndex()
+        for email in self._received_emails if box == "received" else self._sent_emails:
+            index.add(email)
+        self._indexes[box] = index
+        self.versions[box] += 1
+
+    def get(self, mail_id: int) -> Optional["Email"]:
+        return self._indexes["received"].by_id.get(mail_id)
+
+    def find(
+        self,
+        sender: Optional[str] = None,
+        receiver: Optional[str] = None,
+        since_turn: Optional[int] = None,
+        until_turn: Optional[int] = None,
+        box: str = "received",
+    ) -> list["Email"]:
+        """
+        Returns the mails of the `box` ("received" or "sent") matching all the
+        provided filters, in the order they were added. Turn bounds are inclusive.
+        """
+        index = self._indexes[box]
+        candidates: Optional[list[Email]] = None
+        if sender is not None:
+            candidates = index.by_sender.get(sender, [])
+        if receiver is not None:
+            by_receiver = index.by_receiver.get(receiver, [])
+            if candidates is None or len(by_receiver) < len(candidates):
+                candidates = by_receiver
+        if candidates is None:
+            if since_turn is None and until_turn is None:
+                return list(self._received_emails if box == "received" else self._sent_emails)
+            candidates = index.between_turns(since_turn, until_turn)
+
+        return [
+            email
+            for email in candidates
+            if (sender is None or email.sender == sender)
+            and (receiver is None or email.receiver == receiver)
+            and (since_turn is None or email.turn >= since_turn)
+            and (until_turn is None or email.turn <= until_turn)
+        ]
 
     def display(self) -> str:
         if not self.received_emails:
@@ -18,12 +259,7 @@ class EmailBox:
         return email_box
 
     def read_email(self, mail_id: int) -> str:
-        requested_email = None
-        for email in self.received_emails:
-            if email.id == mail_id:
-                requested_email = email
-                break
-
+        requested_email = self.get(mail_id)
         if not requested_email:
             return f"The email with id `{mail_id}` was not found."
         return requested_email.string
@@ -63,6 +299,12 @@ class EmailBox:
 
 
 class Email:
+    """
+    Dynamic content (`dynamic::<instructions>`) and dynamic objects are only
+    generated on first access to `.content`, `.object` or `.string`, and
+    cached afterwards. `prefetch()` warms them in a background thread.
+    """
+
     def __init__(
         self,
         sender: str,
@@ -71,34 +313,78 @@ class Email:
         content: str,
         turn: int,
         attached_file: Optional[str] = None,
+        mail_id: Optional[int] = None,
     ) -> None:
+        self.id = mail_id if mail_id is not None else _default_id_allocator.next_id()
         self.sender = sender
         self.receiver = receiver
-        self.object = object
         self.attached_file: str = attached_file
+        self.turn = turn
         self._log = {}
+        self.on_generated: Optional[Callable[[dict], None]] = None
+        self._lock = threading.RLock()
 
+        # Callable contents are evaluated right away, so that the context they
+        # capture is the one at sending time, even if generation happens later
         if isinstance(content, Callable):
             content = content()
 
-        if "dynamic::" in content:
-            content = content.split("dynamic::")[1]
+        self.raw_content: str = content
+        self.raw_object: str = object
+        self._content: Optional[str] = None if "dynamic::" in content else content
+        self._object: Optional[str] = None if object == "dynamic::" else object
+
+    @property
+    def is_resolved(self) -> bool:
+        return self._content is not None and self._object is not None
+
+    @property
+    def content(self) -> str:
+        if self._content is None:
+            self._generate_content()
+        return self._content
+
+    @property
+    def object(self) -> str:
+        if self._object is None:
+            self._generate_object()
+        return self._object
+
+    def prefetch(self) -> None:
+        if not self.is_resolved:
+            _prefetch_executor.submit(self._generate_object)
+
+    def _notify(self, log: dict) -> None:
+        if self.on_generated:
+            self.on_generated(log)
+
+    @profiled("email.generate_content")
+    def _generate_content(self) -> None:
+        with self._lock:
+            if self._content is not None:
+                return
             messages = [
                 {
                     "role": "developer",
                     "content": f"You are {self.sender} and must send a mail to {self.receiver}. You will receive some additional context clues from the user as well as instructions, you must follow the instructions very precisly, and use the context in a way that is smart. You will only answer with the content of the mail, not the object.",
                 },
-                {"role": "user", "content": content},
+                {"role": "user", "content": self.raw_content.split("dynamic::")[1]},
             ]
             self._log["dynamic_message"] = messages
-            completion = client.chat.completions.create(
+            completion = get_client().create(
                 model="gpt-4o-mini",
                 messages=messages,
                 max_tokens=256,
             )
-            content = completion.choices[0].message.content
+            self._content = completion.choices[0].message.content
+            self._notify({"dynamic_message": messages, "generated": self._content})
 
-        if self.object == "dynamic::":
+    @profiled("email.generate_object")
+    def _generate_object(self) -> None:
+        with self._lock:
+            content = self.content
+            if self._object is not None:
+                return
             messages = [
                 {
                     "role": "developer",
@@ -110,18 +396,13 @@ class Email:
                 },
             ]
             self._log["dynamic_object"] = messages
-            completion = client.chat.completions.create(
+            completion = get_client().create(
                 model="gpt-4o-mini",
                 messages=messages,
                 max_tokens=10,
             )
-            self.object = completion.choices[0].message.content
-        self.content = content
-        self.turn = turn
-
-    @cached_property
-    def id(self):
-        return int(str(hash(self))[-4:-1])
+            self._object = completion.choices[0].message.content
+            self._notify({"dynamic_object": messages, "generated": self._object})
 
     @property
     def string(self):
@@ -0,0 +1,193 @@
+import os
+import threading
+from argparse import ArgumentParser
+from typing import Optional
+
+import fitz
+
+from workspace_for_agents.cache import LRUCache, SQLiteStore, hash_key
+from workspace_for_agents.profiling import profiled
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "pdf_text.sqlite")
+
+
+class PDFDocumentPool:
+    """Process-wide pool of open PDF documents, closed on LRU eviction."""
+
+    def __init__(self, max_open: int = 16) -> None:
+        self._documents = LRUCache(
+            max_open, on_evict=lambda path, document: document.close()
+        )
+        # PyMuPDF documents must not be used from several threads at once
+        self._lock = threading.RLock()
+
+    def _open(self, path: str):
+        document = self._documents.get(path)
+        if document is None:
+            document = fitz.open(path)
+            self._documents.set(path, document)
+        return document
+
+    def page_count(self, path: str) -> int:
+        with self._lock:
+            return len(self._open(path))
+
+    def page_text(self, path: str, page_number: int) -> str:
+        """`page_number` is 1-based."""
+        with self._lock:
+            return self._open(path)[page_number - 1].get_text()
+
+    def all_pages_text(self, path: str) -> list[str]:
+        with self._lock:
+            return [page.get_text() for page in self._open(path)]
+
+    def close(self) -> None:
+        with self._lock:
+            self._documents.clear()
+
+
+class PDFTextCache:
+    """
+    Page text cache keyed by the path, mtime and size of the PDF, in memory
+    and optionally persisted in a SQLite file.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_CACHE_PATH,
+        max_pages_in_memory: int = 8192,
+        max_open_documents: int = 16,
+    ) -> None:
+        self.documents = PDFDocumentPool(max_open_documents)
+        # Objects with a `page_texts(pdf_path)` method (e.g. bundles), tried before the PDF itself
+        self.sources: list = []
+        self.memory = LRUCache(max_pages_in_memory)
+        self.store: Optional[SQLiteStore] = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.store = SQLiteStore(path, "pdf_pages")
+
+    def add_source(self, source) -> None:
+        self.sources.append(source)
+
+    def _source_pages(self, pdf_path: str) -> Optional[list[str]]:
+        for source in self.sources:
+            pages = source.page_texts(pdf_path)
+            if pages is not None:
+                return pages
+        return None
+
+    @staticmethod
+    def document_key(pdf_path: str) -> str:
+        stat = os.stat(pdf_path)
+        return hash_key(os.path.abspath(pdf_path), str(stat.st_mtime_ns), str(stat.st_size))
+
+    def _get(self, key: str):
+        value = self.memory.get(key)
+        if value is None and self.store is not None:
+            value = self.store.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def _set(self, key: str, value) -> None:
+        self.memory.set(key, value)
+        if self.store is not None:
+            self.store.set(key, value)
+
+    def page_count(self, pdf_path: str) -> int:
+        pages = self._source_pages(pdf_path)
+        if pages is not None:
+            return len(pages)
+        key = f"{self.document_key(pdf_path)}#pages"
+        page_count = self._get(key)
+        if page_count is None:
+            page_count = self.documents.page_count(pdf_path)
+            self._set(key, page_count)
+        return page_count
+
+    @profiled("pdf.page_text")
+    def page_text(self, pdf_path: str, page_number: int) -> str:
+        """Returns the text of a page (1-based), raises IndexError if it doesn't exist."""
+        pages = self._source_pages(pdf_path)
+        if pages is not None:
+            if not 1 <= page_number <= len(pages):
+                raise IndexError(f"The document has {len(pages)} pages.")
+            return pages[page_number - 1]
+        page_count = self.page_count(pdf_path)
+        if not 1 <= page_number <= page_count:
+            raise IndexError(f"The document has {page_count} pages.")
+        key = f"{self.document_key(pdf_path)}#{page_number}"
+        text = self._get(key)
+        if text is None:
+            text = self.documents.page_text(pdf_path, page_number)
+            self._set(key, text)
+        return text
+
+    def precompute(self, pdf_path: str) -> int:
+        """Extracts and caches all the pages of a PDF, returns its page count."""
+        document_key = self.document_key(pdf_path)
+        page_count = self._get(f"{document_key}#pages")
+        if page_count is not None and self._get(f"{document_key}#{page_count}") is not None:
+            return page_count
+
+        pages = self.documents.all_pages_text(pdf_path)
+        items = {f"{document_key}#pages": len(pages)}
+        for i, text in enumerate(pages, start=1):
+            items[f"{document_key}#{i}"] = text
+        for key, value in items.items():
+            self.memory.set(key, value)
+        if self.store is not None:
+            self.store.set_many(items)
+        return len(pages)
+
+
+_pdf_cache: Optional[PDFTextCache] = None
+_pdf_cache_lock = threading.Lock()
+
+
+def get_pdf_cache() -> PDFTextCache:
+    global _pdf_cache
+    with _pdf_cache_lock:
+        if _pdf_cache is None:
+            _pdf_cache = PDFTextCache(os.getenv("PDF_TEXT_CACHE", DEFAULT_CACHE_PATH))
+        return _pdf_cache
+
+
+def configure_pdf_cache(path: Optional[str] = DEFAULT_CACHE_PATH, **kwargs) -> PDFTextCache:
+    """Replaces the shared cache. With `path=None`, page texts are only kept in memory."""
+    global _pdf_cache
+    with _pdf_cache_lock:
+        _pdf_cache = PDFTextCache(path, **kwargs)
+        return _pdf_cache
+
+
+def find_pdfs(root: str) -> list[str]:
+    pdf_paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.lower().endswith(".pdf"):
+                pdf_paths.append(os.path.join(dirpath, filename))
+    return sorted(pdf_paths)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Extracts the text of every PDF of a corpus.")
+    parser.add_argument("roots", nargs="+", help="Folders (or PDF files) to extract")
+    parser.add_argument("--cache_path", type=str, default=DEFAULT_CACHE_PATH)
+    args = parser.parse_args()
+
+    cache = configure_pdf_cache(args.cache_path)
+    for root in args.roots:
+        pdf_paths = [root] if os.path.isfile(root) else find_pdfs(root)
+        for pdf_path in pdf_paths:
+            try:
+                page_count = cache.precompute(pdf_path)
+                print(f"{pdf_path}: {page_count} pages")
+            except Exception as e:
+                print(f"{pdf_path}: error ({e})")
+
+
+if __name__ == "__main__":
+    main()
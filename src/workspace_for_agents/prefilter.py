@@ -0,0 +1,276 @@
+import json
+import math
+import random
+import re
+import threading
+from argparse import ArgumentParser
+from collections import Counter
+from typing import Any, Callable, Iterable, Optional
+
+from workspace_for_agents.cache import hash_key
+
+# Returns a verdict when confident, None to escalate to the LLM
+Prefilter = Callable[[str, str], Optional[bool]]
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class KeywordRule:
+    """
+    Keyword rule declared next to a semantic condition: the condition is
+    considered true if the context contains one of the `positive` keywords,
+    false if it contains one of the `negative` ones (and ambiguous if both).
+    When none match, `if_no_match` is returned (None escalates to the LLM).
+    """
+
+    def __init__(
+        self,
+        positive: Iterable[str] = (),
+        negative: Iterable[str] = (),
+        if_no_match: Optional[bool] = None,
+    ) -> None:
+        self.positive = self._compile(positive)
+        self.negative = self._compile(negative)
+        self.if_no_match = if_no_match
+
+    @staticmethod
+    def _compile(keywords: Iterable[str]) -> Optional[re.Pattern]:
+        keywords = list(keywords)
+        if not keywords:
+            return None
+        return re.compile(
+            "|".join(rf"\b{re.escape(keyword)}\b" for keyword in keywords), re.IGNORECASE
+        )
+
+    def __call__(self, condition: str, context: str) -> Optional[bool]:
+        positive = bool(self.positive and self.positive.search(context))
+        negative = bool(self.negative and self.negative.search(context))
+        if positive and negative:
+            return None
+        if positive:
+            return True
+        if negative:
+            return False
+        return self.if_no_match
+
+
+class TfidfLogisticScorer:
+    """
+    Logistic regression on TF-IDF features of the context, trained from
+    recorded verdicts. Features are specific to each condition (plus shared
+    ones), and conditions with fewer than `min_examples` training examples
+    are always escalated. Only answers when the probability is above
+    `threshold` (or below 1 - `threshold`).
+    """
+
+    def __init__(self, threshold: float = 0.95, min_examples: int = 10) -> None:
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self.idf: dict[str, float] = {}
+        self.weights: dict[str, float] = {}
+        self.examples_per_condition: dict[str, int] = {}
+
+    @staticmethod
+    def condition_id(condition: str) -> str:
+        return hash_key(condition)[:12]
+
+    def _features(self, condition_id: str, context: str) -> dict[str, float]:
+        counts = Counter(tokenize(context))
+        features = {}
+        for token, count in counts.items():
+            if token in self.idf:
+                value = (1 + math.log(count)) * self.idf[token]
+                features[token] = value
+                features[f"{condition_id}:{token}"] = value
+        norm = math.sqrt(sum(value**2 for value in features.values())) or 1.0
+        features = {name: value / norm for name, value in features.items()}
+        features[f"{condition_id}:<bias>"] = 1.0
+        return features
+
+    def _probability(self, features: dict[str, float]) -> float:
+        score = sum(self.weights.get(name, 0.0) * value for name, value in features.items())
+        return 1 / (1 + math.exp(-max(-30.0, min(30.0, score))))
+
+    def train(
+        self,
+        examples: list[tuple[str, str, bool]],
+        epochs: int = 30,
+        learning_rate: float = 0.5,
+        l2: float = 1e-4,
+        seed: int = 0,
+    ) -> None:
+        """`examples` are (condition, context, verdict) triples."""
+        document_frequencies = Counter()
+        for _, context, _ in examples:
+            document_frequencies.update(set(tokenize(context)))
+        self.idf = {
+            token: math.log((1 + len(examples)) / (1 + frequency)) + 1
+            for token, frequency in document_frequencies.items()
+        }
+        self.examples_per_condition = dict(
+            Counter(self.condition_id(condition) for condition, _, _ in examples)
+        )
+
+        samples = [
+            (self._features(self.condition_id(condition), context), verdict)
+            for condition, context, verdict in examples
+        ]
+        self.weights = {}
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(samples)
+            for features, verdict in samples:
+                error = self._probability(features) - float(verdict)
+                for name, value in features.items():
+                    weight = self.weights.get(name, 0.0)
+                    self.weights[name] = weight - learning_rate * (error * value + l2 * weight)
+
+    def probability(self, condition: str, context: str) -> Optional[float]:
+        condition_id = self.condition_id(condition)
+        if self.examples_per_condition.get(condition_id, 0) < self.min_examples:
+            return None
+        return self._probability(self._features(condition_id, context))
+
+    def __call__(self, condition: str, context: str) -> Optional[bool]:
+        probability = self.probability(condition, context)
+        if probability is None:
+            return None
+        if probability >= self.threshold:
+            return True
+        if probability <= 1 - self.threshold:
+            return False
+        return None
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "threshold": self.threshold,
+                    "min_examples": self.min_examples,
+                    "idf": self.idf,
+                    "weights": self.weights,
+                    "examples_per_condition": self.examples_per_condition,
+                },
+                f,
+                ensure_ascii=False,
+            )
+
+    @classmethod
+    def load(cls, path: str, threshold: Optional[float] = None) -> "TfidfLogisticScorer":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        scorer = cls(
+            threshold if threshold is not None else data["threshold"],
+            data["min_examples"],
+        )
+        scorer.idf = data["idf"]
+        scorer.weights = data["weights"]
+        scorer.examples_per_condition = data["examples_per_condition"]
+        return scorer
+
+
+def load_verdicts(path: str) -> list[tuple[str, str, bool]]:
+    """Reads the verdicts recorded by `semantic_is_true` (see `configure_semantic_prefilter`)."""
+    examples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                examples.append((record["condition"], record["context"], record["verdict"]))
+    return examples
+
+
+class PrefilterStats:
+    """
+    Counts how semantic checks were answered, to tune the prefilter threshold.
+    Checks are counted once per distinct check (cache key), however many
+    times conditions evaluate them.
+    """
+
+    def __init__(self) -> None:
+        self.counts: Counter = Counter()
+        self._seen: set[str] = set()
+        self._lock = threading.Lock()
+
+    def add(self, *names: str) -> None:
+        with self._lock:
+            self.counts.update(names)
+
+    def add_once(self, key: str, *names: str) -> bool:
+        """Counts `names` for `key` unless `key` was already counted, returns whether it was."""
+        with self._lock:
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+            self.counts.update(names)
+            return True
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts = Counter()
+            self._seen = set()
+
+    def report(self) -> dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        checks = counts.get("checks", 0)
+        audited = counts.get("audited", 0)
+        return {
+            **counts,
+            "escalation_rate": counts.get("escalated", 0) / checks if checks else 0.0,
+            "disagreement_rate": (
+                counts.get("disagreements", 0) / audited if audited else 0.0
+            ),
+        }
+
+
+def evaluate(
+    scorer: TfidfLogisticScorer, examples: list[tuple[str, str, bool]]
+) -> dict[str, Any]:
+    """Escalation and error rates of `scorer` on held-out verdicts."""
+    answered = errors = 0
+    for condition, context, verdict in examples:
+        prediction = scorer(condition, context)
+        if prediction is not None:
+            answered += 1
+            errors += prediction != verdict
+    return {
+        "examples": len(examples),
+        "escalation_rate": 1 - answered / len(examples) if examples else 0.0,
+        "error_rate": errors / answered if answered else 0.0,
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Trains the semantic checks prefilter from recorded verdicts."
+    )
+    parser.add_argument("verdicts", help="JSON Lines file of recorded verdicts")
+    parser.add_argument("output", help="Path of the trained model (JSON)")
+    parser.add_argument("--threshold", type=float, default=0.95)
+    parser.add_argument("--min_examples", type=int, default=10)
+    parser.add_argument(
+        "--test_fraction",
+        type=float,
+        default=0.2,
+        help="Fraction of the verdicts held out to report the escalation and error rates",
+    )
+    args = parser.parse_args()
+
+    examples = load_verdicts(args.verdicts)
+    random.Random(0).shuffle(examples)
+    test_size = int(len(examples) * args.test_fraction)
+    scorer = TfidfLogisticScorer(args.threshold, args.min_examples)
+    if test_size:
+        scorer.train(examples[test_size:])
+        print(json.dumps(evaluate(scorer, examples[:test_size]), indent=4))
+    scorer.train(examples)
+    scorer.save(args.output)
+
+
+if __name__ == "__main__":
+    main()
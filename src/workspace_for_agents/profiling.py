@@ -0,0 +1,175 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Iterator, Optional
+
+TOKEN_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+class _Frame:
+    def __init__(self, path: tuple[str, ...], parent: Optional["_Frame"]) -> None:
+        self.path = path
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.children_seconds = 0.0
+
+
+_current_frame: contextvars.ContextVar[Optional[_Frame]] = contextvars.ContextVar(
+    "profiling_frame", default=None
+)
+
+
+def _empty_stats() -> dict[str, Any]:
+    return {
+        "calls": 0,
+        "total_seconds": 0.0,
+        "self_seconds": 0.0,
+        **{field: 0 for field in TOKEN_FIELDS},
+    }
+
+
+class Profiler:
+    """
+    Collects nested timing spans, aggregated by call path. Spans opened in
+    other threads are attached to their parent span when the thread runs in a
+    copy of the parent's context (see `contextvars.copy_context`).
+
+    When disabled, `span()` costs a single attribute check.
+    """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self._stats: dict[tuple[str, ...], dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = {}
+
+    def span(self, name: str):
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name)
+
+    @contextmanager
+    def _span(self, name: str) -> Iterator[None]:
+        parent = _current_frame.get()
+        frame = _Frame((parent.path if parent else ()) + (name,), parent)
+        token = _current_frame.set(frame)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - frame.start
+            _current_frame.reset(token)
+            with self._lock:
+                stats = self._stats.setdefault(frame.path, _empty_stats())
+                stats["calls"] += 1
+                stats["total_seconds"] += elapsed
+                # Children running concurrently can exceed their parent's wall time
+                stats["self_seconds"] += max(0.0, elapsed - frame.children_seconds)
+                if parent:
+                    parent.children_seconds += elapsed
+
+    def add_usage(self, usage: dict[str, Any]) -> None:
+        """Attributes the token usage of an LLM call to the current span."""
+        if not self.enabled:
+            return
+        frame = _current_frame.get()
+        path = frame.path if frame else ("<no span>",)
+        with self._lock:
+            stats = self._stats.setdefault(path, _empty_stats())
+            for field in TOKEN_FIELDS:
+                stats[field] += usage.get(field, 0)
+
+    def report(self) -> dict[str, Any]:
+        with self._lock:
+            spans = [
+                {"path": list(path), **dict(stats)} for path, stats in self._stats.items()
+            ]
+        return build_report(spans)
+
+
+def build_report(spans: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Builds a profile report from per-path span stats: the spans sorted by
+    total time, and the totals of each span name, whatever its callers.
+    """
+    by_name: dict[str, dict[str, Any]] = {}
+    for span in spans:
+        totals = by_name.setdefault(span["path"][-1], _empty_stats())
+        for field in totals:
+            # Total time is only counted once for recursive spans (e.g. composite conditions)
+            if field == "total_seconds" and span["path"][-1] in span["path"][:-1]:
+                continue
+            totals[field] += span[field]
+    return {
+        "wall_seconds": sum(span["total_seconds"] for span in spans if len(span["path"]) == 1),
+        "by_name": dict(
+            sorted(by_name.items(), key=lambda item: item[1]["total_seconds"], reverse=True)
+        ),
+        "spans": sorted(spans, key=lambda span: span["total_seconds"], reverse=True),
+    }
+
+
+def merge_reports(reports: list[dict[str, Any]]) -> dict[str, Any]:
+    """Accumulates the reports of several episodes into a single one."""
+    merged: dict[tuple[str, ...], dict[str, Any]] = {}
+    for report in reports:
+        for span in report["spans"]:
+            stats = merged.setdefault(tuple(span["path"]), _empty_stats())
+            for field in stats:
+                stats[field] += span[field]
+    report = build_report(
+        [{"path": list(path), **stats} for path, stats in merged.items()]
+    )
+    report["episodes"] = len(reports)
+    return report
+
+
+def to_folded(report: dict[str, Any]) -> str:
+    """
+    Folded stacks (`a;b;c <self time in µs>`), as read by flamegraph.pl,
+    speedscope or inferno.
+    """
+    lines = []
+    for span in report["spans"]:
+        stack = ";".join(name.replace(";", ",").replace(" ", "_") for name in span["path"])
+        microseconds = round(span["self_seconds"] * 1_000_000)
+        if microseconds > 0:
+            lines.append(f"{stack} {microseconds}")
+    return "\n".join(sorted(lines)) + "\n"
+
+
+def save_report(report: dict[str, Any], path: str) -> None:
+    """Saves the report as JSON at `path`, and as folded stacks next to it."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    with open(os.path.splitext(path)[0] + ".folded", "w", encoding="utf-8") as f:
+        f.write(to_folded(report))
+
+
+profiler = Profiler(enabled=bool(os.getenv("PROFILE")))
+
+
+def get_profiler() -> Profiler:
+    return profiler
+
+
+def profiled(name: str) -> Callable:
+    """Decorator wrapping every call of the function in a span."""
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profiler.span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
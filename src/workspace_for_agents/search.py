@@ -0,0 +1,288 @@
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from argparse import ArgumentParser
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from workspace_for_agents.pdf_cache import get_pdf_cache
+from workspace_for_agents.profiling import profiled
+
+DEFAULT_INDEX_PATH = os.path.join(".cache", "search_index.json")
+# Markdown files are split into passages of about this size
+MARKDOWN_PASSAGE_CHARS = 1500
+SNIPPET_CHARS = 240
+
+_TOKEN = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Lowercases and removes the accents, so that `reseau` matches `Réseau`."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(normalize(text))
+
+
+def is_searchable(path: str) -> bool:
+    return path.lower().endswith((".pdf", ".md"))
+
+
+def _markdown_passages(path: str) -> list[tuple[Optional[int], int, str]]:
+    """(page, line, text) passages of a Markdown file, split on blank lines."""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    passages = []
+    start, current = 1, []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip() and sum(len(l) for l in current) >= MARKDOWN_PASSAGE_CHARS:
+            passages.append((None, start, "\n".join(current)))
+            start, current = number + 1, []
+        else:
+            current.append(line)
+    if any(line.strip() for line in current):
+        passages.append((None, start, "\n".join(current)))
+    return passages
+
+
+def _pdf_passages(path: str) -> list[tuple[Optional[int], int, str]]:
+    cache = get_pdf_cache()
+    return [
+        (page, 1, cache.page_text(path, page))
+        for page in range(1, cache.page_count(path) + 1)
+    ]
+
+
+@dataclass
+class SearchHit:
+    path: str
+    page: Optional[int]  # PDF page, None for Markdown files
+    line: int
+    snippet: str
+    score: float
+
+
+class SearchIndex:
+    """
+    BM25 inverted index over the pages of PDFs and the passages of Markdown
+    files. Files are indexed the first time they are searched (or when they
+    changed since), and the index is persisted to `path` when it changes.
+    """
+
+    def __init__(
+        self, path: Optional[str] = DEFAULT_INDEX_PATH, k1: float = 1.2, b: float = 0.75
+    ) -> None:
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        # path -> {"mtime_ns", "size", "passages": [passage ids]}
+        self.files: dict[str, dict] = {}
+        # passage id -> [path, page, line, text, length]
+        self.passages: dict[int, list] = {}
+        # term -> {passage id: term frequency}
+        self.postings: dict[str, dict[int, int]] = {}
+        self.total_length = 0
+        self._next_id = 0
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            files = data["files"]
+            passages = {int(i): passage for i, passage in data["passages"].items()}
+            postings = {
+                term: {int(i): tf for i, tf in term_postings.items()}
+                for term, term_postings in data["postings"].items()
+            }
+            total_length = sum(passage[4] for passage in passages.values())
+        except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+            # Left empty: the files are indexed again when they are searched
+            print(f"Warning! Couldn't read the search index {self.path} ({e}), rebuilding it")
+            return
+        self.files, self.passages, self.postings = files, passages, postings
+        self.total_length = total_length
+        self._next_id = max(self.passages, default=-1) + 1
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            directory = os.path.dirname(self.path) or "."
+            temp_path = None
+            try:
+                os.makedirs(directory, exist_ok=True)
+                # Written aside then moved, so that other processes never read a partial index
+                fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                with open(fd, "w", encoding="utf-8") as f:
+                    json.dump(
+                        {"files": self.files, "passages": self.passages, "postings": self.postings},
+                        f,
+                        ensure_ascii=False,
+                    )
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                print(f"Warning! Couldn't save the search index to {self.path} ({e})")
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normpath(path)
+
+    def _remove_file(self, key: str) -> None:
+        for passage_id in self.files.pop(key)["passages"]:
+            path, page, line, text, length = self.passages.pop(passage_id)
+            self.total_length -= length
+            for term in set(tokenize(text)):
+                self.postings[term].pop(passage_id, None)
+                if not self.postings[term]:
+                    del self.postings[term]
+
+    def _add_file(self, path: str, stat: os.stat_result) -> None:
+        passages = _pdf_passages(path) if path.lower().endswith(".pdf") else _markdown_passages(path)
+        passage_ids = []
+        for page, line, text in passages:
+            passage_id = self._next_id
+            self._next_id += 1
+            terms = tokenize(text)
+            self.passages[passage_id] = [path, page, line, text, len(terms)]
+            self.total_length += len(terms)
+            for term, frequency in Counter(terms).items():
+                self.postings.setdefault(term, {})[passage_id] = frequency
+            passage_ids.append(passage_id)
+        self.files[self._key(path)] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "passages": passage_ids,
+        }
+
+    @profiled("search.update")
+    def update(self, paths: Iterable[str]) -> int:
+        """Indexes the files that are new or changed, returns how many were (re)indexed."""
+        indexed = 0
+        with self._lock:
+            for path in paths:
+                if not is_searchable(path):
+                    continue
+                key = self._key(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entry = self.files.get(key)
+                if entry and (entry["mtime_ns"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                if entry:
+                    self._remove_file(key)
+                try:
+                    self._add_file(path, stat)
+                    indexed += 1
+                except Exception as e:
+                    print(f"Warning! Couldn't index {path} ({e})")
+            if indexed:
+                self.save()
+        return indexed
+
+    @staticmethod
+    def snippet(text: str, terms: set[str]) -> str:
+        """A window of the text around the first matching term."""
+        normalized = normalize(text)
+        # Offsets only line up with the text when normalizing kept its length (e.g. no ligatures)
+        source = text if len(normalized) == len(text) else normalized
+        start = next(
+            (match.start() for match in _TOKEN.finditer(normalized) if match.group() in terms), 0
+        )
+        start = max(0, start - SNIPPET_CHARS // 3)
+        end = start + SNIPPET_CHARS
+        snippet = " ".join(source[start:end].split())
+        return ("..." if start > 0 else "") + snippet + ("..." if end < len(source) else "")
+
+    @profiled("search.query")
+    def search(
+        self, query: str, paths: Optional[Iterable[str]] = None, max_results: int = 5
+    ) -> list[SearchHit]:
+        """Ranks the passages matching `query`, among the files in `paths` if provided."""
+        terms = set(tokenize(query))
+        allowed = {self._key(path) for path in paths} if paths is not None else None
+        with self._lock:
+            n_passages = len(self.passages)
+            if not n_passages or not terms:
+                return []
+            average_length = self.total_length / n_passages
+            scores: Counter = Counter()
+            for term in terms:
+                postings = self.postings.get(term, {})
+                idf = math.log(1 + (n_passages - len(postings) + 0.5) / (len(postings) + 0.5))
+                for passage_id, frequency in postings.items():
+                    path, page, line, text, length = self.passages[passage_id]
+                    if allowed is not None and self._key(path) not in allowed:
+                        continue
+                    scores[passage_id] += idf * frequency * (self.k1 + 1) / (
+                        frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                    )
+            hits = []
+            for passage_id, score in scores.most_common(max_results):
+                path, page, line, text, length = self.passages[passage_id]
+                hits.append(SearchHit(path, page, line, self.snippet(text, terms), score))
+            return hits
+
+
+_search_index: Optional[SearchIndex] = None
+_search_index_lock = threading.Lock()
+
+
+def get_search_index() -> SearchIndex:
+    global _search_index
+    with _search_index_lock:
+        if _search_index is None:
+            _search_index = SearchIndex(os.getenv("SEARCH_INDEX", DEFAULT_INDEX_PATH))
+        return _search_index
+
+
+def configure_search_index(path: Optional[str] = DEFAULT_INDEX_PATH, **kwargs) -> SearchIndex:
+    """Replaces the shared index. With `path=None`, the index is only kept in memory."""
+    global _search_index
+    with _search_index_lock:
+        _search_index = SearchIndex(path, **kwargs)
+        return _search_index
+
+
+def find_searchable_files(root: str) -> list[str]:
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if is_searchable(filename):
+                paths.append(os.path.join(dirpath, filename))
+    return sorted(paths)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Indexes the PDFs and Markdown files of a corpus.")
+    parser.add_argument("roots", nargs="+", help="Folders (or files) to index")
+    parser.add_argument("--index_path", type=str, default=DEFAULT_INDEX_PATH)
+    parser.add_argument("--query", type=str, default=None, help="Searches the index afterwards")
+    args = parser.parse_args()
+
+    index = configure_search_index(args.index_path)
+    paths = []
+    for root in args.roots:
+        paths += [root] if os.path.isfile(root) else find_searchable_files(root)
+    print(f"{index.update(paths)} files indexed, {len(index.passages)} passages")
+    if args.query:
+        for hit in index.search(args.query, paths):
+            location = f"page {hit.page}" if hit.page else f"line {hit.line}"
+            print(f"{hit.path} ({location}, {hit.score:.2f}): {hit.snippet}")
+
+
+if __name__ == "__main__":
+    main()
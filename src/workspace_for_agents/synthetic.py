@@ -0,0 +1,107 @@
+import json
+import os
+import random
+from typing import Any
+
+TAGS = [
+    "dev",
+    "network",
+    "data",
+    "HR",
+    "sales",
+    "legal",
+    "finance",
+    "support",
+    "ops",
+    "design",
+]
+FIRST_NAMES = [
+    "Noah", "Liam", "Olivia", "Lucas", "Emma", "Mason", "Ava", "Chen", "Léa",
+    "Ibrahim", "Madeline", "Hannah", "Tariq", "Samantha", "Hermandes", "Yuki",
+    "Amara", "Mateo", "Priya", "Sven",
+]  # fmt: skip
+LAST_NAMES = [
+    "Bennet", "Grant", "Hughes", "Green", "Kelly", "Wei", "Dubois", "Mendoza",
+    "Brooks", "Hoster", "Hassan", "Huynh", "Garcia", "Tanaka", "Okafor",
+    "Rossi", "Sharma", "Larsen", "Novak", "Silva",
+]  # fmt: skip
+
+
+def _create_folder_tree(
+    path: str, depth: int, branching: int, files_per_folder: int
+) -> None:
+    os.makedirs(path, exist_ok=True)
+    for i in range(files_per_folder):
+        extension = ".md" if i % 2 else ".pdf"
+        # Empty files: only the tree matters to the simulator
+        open(os.path.join(path, f"document_{i}{extension}"), "w").close()
+    if depth > 0:
+        for i in range(branching):
+            _create_folder_tree(
+                os.path.join(path, f"folder_{i}"), depth - 1, branching, files_per_folder
+            )
+
+
+def _sample_others(rng: random.Random, n: int, excluded: int, k: int) -> list[int]:
+    # Avoids building the list of all the other employees for large organizations
+    sample: set[int] = set()
+    while len(sample) < k:
+        j = rng.randrange(n)
+        if j != excluded:
+            sample.add(j)
+    return sorted(sample)
+
+
+def generate_environment(
+    n_employees: int,
+    files_root: str,
+    contacts_per_employee: int = 20,
+    n_folders: int = 0,
+    folder_depth: int = 3,
+    folder_branching: int = 2,
+    files_per_folder: int = 10,
+    folders_per_employee: int = 2,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """
+    Generates the data of a synthetic environment, in the format read by
+    `create_environnement_from_file`, and creates its folder trees (with empty
+    files) under `files_root`. By default, there is one folder per 50 employees.
+    """
+    rng = random.Random(seed)
+    employees = []
+    for i in range(n_employees):
+        first_name = FIRST_NAMES[i % len(FIRST_NAMES)]
+        last_name = LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]
+        employees.append(
+            {
+                "id": i,
+                "name": f"{first_name} {last_name} {i}",
+                "email": f"{first_name.lower()}.{last_name.lower()}.{i}@company.com",
+                "tags": rng.sample(TAGS, rng.randint(1, 2)),
+                "contacts_ids": _sample_others(
+                    rng, n_employees, i, min(contacts_per_employee, n_employees - 1)
+                ),
+                "additional_information": f"{first_name} works in the company.",
+            }
+        )
+
+    folders = []
+    for i in range(n_folders or max(1, n_employees // 50)):
+        path = os.path.join(files_root, f"shared_{i}")
+        _create_folder_tree(path, folder_depth, folder_branching, files_per_folder)
+        folders.append({"path": path, "has_access": []})
+    for employee in employees:
+        for folder in rng.sample(folders, min(folders_per_employee, len(folders))):
+            folder["has_access"].append(employee["id"])
+
+    return {"employees": employees, "folders": folders}
+
+
+def write_environment(path: str, n_employees: int, files_root: str, **kwargs) -> str:
+    env_data = generate_environment(n_employees, files_root, **kwargs)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(env_data, f, ensure_ascii=False)
+    return path
@@ -1,8 +1,20 @@
 from typing import Optional
 from workspace_for_agents.employee import Employee
 from workspace_for_agents.environment import Environment
+from workspace_for_agents.prefilter import KeywordRule, Prefilter
 from workspace_for_agents.utils import semantic_is_true
 
+# Mails that obviously contain new year wishes don't need the LLM, the others are still checked
+NEW_YEAR_WISHES_RULE = KeywordRule(
+    positive=[
+        "happy new year",
+        "new year wishes",
+        "wishes for the new year",
+        "best wishes for the year",
+        "bonne année",
+    ]
+)
+
 
 def mail_exists(
     environment: Environment,
@@ -11,28 +23,33 @@ def mail_exists(
     mail_condition: Optional[str] = None,
     mail_older_than: Optional[int] = None,
     mail_newer_than: Optional[int] = None,
+    prefilter: Optional[Prefilter] = None,
 ) -> bool:
     if isinstance(receiver, Employee):
         receiver = receiver.email
-    for sent_mail in sender.email_box.sent_emails:
-        if (
-            mail_older_than != None
-            and environment.current_turn - sent_mail.turn < mail_older_than
-        ):
-            continue
-        if (
-            mail_newer_than != None
-            and environment.current_turn - sent_mail.turn > mail_newer_than
+    candidate_mails = sender.email_box.find(
+        receiver=receiver,
+        since_turn=(
+            environment.current_turn - mail_newer_than
+            if mail_newer_than != None
+            else None
+        ),
+        until_turn=(
+            environment.current_turn - mail_older_than
+            if mail_older_than != None
+            else None
+        ),
+        box="sent",
+    )
+    for sent_mail in candidate_mails:
+        if not mail_condition:
+            return True
+        if semantic_is_true(
+            f"You should set the condition as true if the following proposition is true: {mail_condition}''",
+            sent_mail.string,
+            prefilter=prefilter,
         ):
-            continue
-        if receiver == sent_mail.receiver:
-            if not mail_condition:
-                return True
-            if semantic_is_true(
-                f"You should set the condition as true if the following proposition is true: {mail_condition}''",
-                sent_mail.string,
-            ):
-                return True
+            return True
     return False
 
 
@@ -42,7 +59,13 @@ def mail_does_not_exists(
     receiver: str | Employee,
     mail_condition: Optional[str] = None,
     max_delta_turns: Optional[int] = None,
+    prefilter: Optional[Prefilter] = None,
 ) -> bool:
     return not mail_exists(
-        environment, sender, receiver, mail_condition, max_delta_turns
+        environment,
+        sender,
+        receiver,
+        mail_condition,
+        max_delta_turns,
+        prefilter=prefilter,
     )
@@ -1,8 +1,11 @@
 from workspace_for_agents.actions import (
     AndCondition,
     Condition,
+    ConditionCost,
     ConditionedAction,
+    MailboxChanged,
     SendEmail,
+    TurnAdvanced,
 )
 from workspace_for_agents.employee import Employee
 from workspace_for_agents.environment import Environment
@@ -23,26 +26,25 @@ def has_sent_email(employee: Employee, target: str) -> bool:
 
 
 def has_not_received_mail(env: Environment, employee: Employee, max_turn: int) -> bool:
-    if env.current_turn > max_turn and env.agent.email not in [
-        mail.sender for mail in employee.email_box.received_emails
-    ]:
+    if env.current_turn > max_turn and not employee.email_box.find(
+        sender=env.agent.email
+    ):
         return True
     return False
 
 
 def received_mail_from_agent(employee: Employee, env: Environment) -> bool:
-    for mail in employee.email_box.received_emails:
-        if mail.sender == env.agent.email:
-            return True
-    return False
+    return bool(employee.email_box.find(sender=env.agent.email))
 
 
 def agent_mail_was_recent(employee: Employee, env: Environment) -> bool:
-    mail_was_recent = False
-    for mail in employee.email_box.received_emails:
-        if mail.sender == env.agent.email and abs(mail.turn - env.current_turn) == 0:
-            mail_was_recent = True
-    return mail_was_recent
+    return bool(
+        employee.email_box.find(
+            sender=env.agent.email,
+            since_turn=env.current_turn,
+            until_turn=env.current_turn,
+        )
+    )
 
 
 def setup_task(env: Environment) -> Task:
@@ -92,6 +94,8 @@ def setup_task(env: Environment) -> Task:
                 mail_condition=f"{env.agent.email} is reaching out to assist you, or is asking for additional information.",
             ),
             name="agent-sent-mail-to-ibrahim",
+            depends_on=[MailboxChanged(env.agent, "sent")],
+            cost=ConditionCost.LLM,
         ),
         SendEmail(
             env.agent.email,
@@ -109,6 +113,8 @@ def setup_task(env: Environment) -> Task:
                 mail_condition=f"Condition should be valid if {env.agent.email} is reaching out to ask for more information about who to contact.",
             ),
             name="agent-sent-mail-to-ibrahim",
+            depends_on=[MailboxChanged(env.agent, "sent")],
+            cost=ConditionCost.LLM,
         ),
         SendEmail(
             env.agent.email,
@@ -119,7 +125,11 @@ def setup_task(env: Environment) -> Task:
         requires_completion=[IBRAHIM.preplanned_actions["send-mail-agent-need-hire"]],
     )
     IBRAHIM.preplanned_actions["ibrahim-requires-help"] = ConditionedAction(
-        lambda: env.current_turn >= 3 and mail_does_not_exists(env, env.agent, IBRAHIM),
+        Condition(
+            lambda: env.current_turn >= 3
+            and mail_does_not_exists(env, env.agent, IBRAHIM),
+            depends_on=[TurnAdvanced(env), MailboxChanged(env.agent, "sent")],
+        ),
         SendEmail(
             env.agent.email,
             "RE: Requiring immediate help.",
@@ -146,6 +156,7 @@ Ibrahim Mendoza""",
             Condition(
                 lambda e=employee: mail_exists(env, env.agent, e, mail_newer_than=0),
                 name=f"agent-sent-mail-to-{employee.email}",
+                depends_on=[MailboxChanged(env.agent, "sent"), TurnAdvanced(env)],
             ),
             SendEmail(
                 env.agent.email,
@@ -159,12 +170,17 @@ Ibrahim Mendoza""",
 
     MADELINE.preplanned_actions["send-hires-list"] = ConditionedAction(
         condition=AndCondition(
-            Condition(lambda e=MADELINE: received_mail_from_agent(e, env)),
+            Condition(
+                lambda e=MADELINE: received_mail_from_agent(e, env),
+                depends_on=[MailboxChanged(MADELINE, "received")],
+            ),
             Condition(
                 lambda: semantic_is_true(
                     f"Condition should be valid if received a mail from {env.agent.email} asking for help with the hiring of a new employee.",
                     MADELINE.all_important_infos,
-                )
+                ),
+                depends_on=[MailboxChanged(MADELINE)],
+                cost=ConditionCost.LLM,
             ),
         ),
         linked_action=SendEmail(
@@ -8,6 +8,7 @@ from workspace_for_agents.employee import Employee
 from workspace_for_agents.environment import Environment
 from workspace_for_agents.task import Goal, Task
 from workspace_for_agents.tasks.generic_conditions import (
+    NEW_YEAR_WISHES_RULE,
     mail_does_not_exists,
     mail_exists,
 )
@@ -29,6 +30,7 @@ def setup_task(env: Environment) -> Task:
         object="Need help communicating info",
         content="Hello Agent,\nI need some help communicating my best wishes for the new year to everyone in the company. Could you do that for me? Make sure to not forget anyone\n\nThank you",
         turn=0,
+        mail_id=env.email_ids.next_id(),
     )
     HANNAH.email_box.sent_emails.append(EXPLANATION_MAIL)
     env.agent.email_box.received_emails.append(EXPLANATION_MAIL)
@@ -44,6 +46,7 @@ def setup_task(env: Environment) -> Task:
                         sender=env.agent,
                         receiver=e.email,
                         mail_condition="The mail's content contains wishes for the new year",
+                        prefilter=NEW_YEAR_WISHES_RULE,
                     )
                 ],
             )
@@ -3,11 +3,13 @@ from workspace_for_agents.actions import (
     Condition,
     ConditionedAction,
     SendEmail,
+    TurnAdvanced,
 )
 from workspace_for_agents.employee import Employee
 from workspace_for_agents.environment import Environment
 from workspace_for_agents.task import Goal, Task
 from workspace_for_agents.tasks.generic_conditions import (
+    NEW_YEAR_WISHES_RULE,
     mail_does_not_exists,
     mail_exists,
 )
@@ -29,11 +31,12 @@ def setup_task(env: Environment) -> Task:
         object="Need help communicating info",
         content="Hello Agent,\nI need some help communicating my best wishes for the new year to everyone in the company. Could you do that for me? Make sure to not forget anyone\n\nThank you",
         turn=0,
+        mail_id=env.email_ids.next_id(),
     )
     HANNAH.email = "hannah.foster@company.fr"
     HANNAH.email_box.sent_emails.append(EXPLANATION_MAIL)
     HANNAH.preplanned_actions["update-agent-with-new-mails"] = ConditionedAction(
-        Condition(lambda: env.current_turn == 1),
+        Condition(lambda: env.current_turn == 1, depends_on=[TurnAdvanced(env)]),
         SendEmail(
             env.agent.email,
             "UPDATE: Need help communicating info",
@@ -54,6 +57,7 @@ def setup_task(env: Environment) -> Task:
                         sender=env.agent,
                         receiver=e.email.replace(".com", ".fr"),
                         mail_condition="The mail's content contains wishes for the new year (on new adress)",
+                        prefilter=NEW_YEAR_WISHES_RULE,
                     )
                 ],
             )
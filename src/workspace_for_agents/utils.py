@@ -1,9 +1,31 @@
+import contextvars
 import json
 import os
+import threading
 import time
-from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
 from pydantic import BaseModel, Field
-from workspace_for_agents.llm_client import client
+from workspace_for_agents.cache import SemanticCache
+from workspace_for_agents.llm_client import get_client
+from workspace_for_agents.prefilter import Prefilter, PrefilterStats
+from workspace_for_agents.profiling import profiled
+
+SEMANTIC_MODEL = "gpt-4o-2024-08-06"
+
+# Verdicts are cached in memory by default. Call `configure_semantic_cache`
+# with a path to also persist them across runs.
+semantic_cache = SemanticCache()
+
+# Cheap classifier tried before the LLM on cache misses, see `configure_semantic_prefilter`
+semantic_prefilter: Optional[Prefilter] = None
+prefilter_audit_rate = 0.0
+verdicts_path: Optional[str] = None
+prefilter_stats = PrefilterStats()
+# cache key -> (condition, context, local verdict) of the checks sent to the LLM
+_escalated_checks: dict[str, tuple[str, str, Optional[bool]]] = {}
+_verdicts_lock = threading.Lock()
 
 
 class ConditionVerification(BaseModel):
@@ -15,18 +37,190 @@ class ConditionVerification(BaseModel):
     )
 
 
-def semantic_is_true(condition: str, context: Optional[str | Callable] = None) -> bool:
+class BatchedVerdict(BaseModel):
+    index: int = Field(description="The index of the item")
+    argumentation: str = Field(
+        description="A few sentences that explain why you think the condition is verified or not."
+    )
+    condition_is_verified: bool = Field(
+        description="Wether or not the condition is verified."
+    )
+
+
+class BatchedVerification(BaseModel):
+    verdicts: list[BatchedVerdict] = Field(description="One verdict per item")
+
+
+class SemanticCheckCollector:
+    """
+    Gathers the semantic checks missing from the cache while conditions are
+    evaluated in collect mode, so that they can be resolved in a few batched
+    requests (see `collecting_semantic_checks`).
+    """
+
+    def __init__(self, already_asked: Optional[set[str]] = None) -> None:
+        # cache key -> (condition, context)
+        self.questions: dict[str, tuple[str, str]] = {}
+        self.already_asked = already_asked if already_asked is not None else set()
+
+    def add(self, cache_key: str, condition: str, context: str) -> None:
+        if cache_key not in self.already_asked:
+            self.questions[cache_key] = (condition, context)
+
+
+_semantic_collector: contextvars.ContextVar[Optional[SemanticCheckCollector]] = (
+    contextvars.ContextVar("semantic_collector", default=None)
+)
+
+
+@contextmanager
+def collecting_semantic_checks(
+    already_asked: Optional[set[str]] = None,
+) -> Iterator[SemanticCheckCollector]:
+    """
+    In this context, `semantic_is_true` doesn't call the LLM on cache misses:
+    it records the question and returns False. Conditions must therefore not
+    keep the values they compute in this mode.
+    """
+    collector = SemanticCheckCollector(already_asked)
+    token = _semantic_collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _semantic_collector.reset(token)
+
+
+def is_collecting_semantic_checks() -> bool:
+    return _semantic_collector.get() is not None
+
+
+def configure_semantic_cache(
+    max_size: int = 4096, path: Optional[str] = None
+) -> SemanticCache:
+    global semantic_cache
+    semantic_cache = SemanticCache(max_size=max_size, path=path)
+    return semantic_cache
+
+
+def configure_semantic_prefilter(
+    prefilter: Optional[Prefilter] = None,
+    audit_rate: float = 0.0,
+    record_verdicts: Optional[str] = None,
+) -> PrefilterStats:
+    """
+    `prefilter` (e.g. a trained `TfidfLogisticScorer`) answers the semantic
+    checks it is confident about, after the rules declared by the conditions.
+    A fraction `audit_rate` of its confident answers are still checked by the
+    LLM to measure disagreements. The LLM verdicts can be appended to the
+    `record_verdicts` JSON Lines file, to train the prefilter.
+    """
+    global semantic_prefilter, prefilter_audit_rate, verdicts_path, prefilter_stats
+    semantic_prefilter = prefilter
+    prefilter_audit_rate = audit_rate
+    verdicts_path = record_verdicts
+    prefilter_stats = PrefilterStats()
+    return prefilter_stats
+
+
+def _local_verdict(
+    condition: str, context: str, prefilter: Optional[Prefilter]
+) -> tuple[Optional[bool], Optional[str]]:
+    if prefilter is not None:
+        verdict = prefilter(condition, context)
+        if verdict is not None:
+            return verdict, "rule"
+    if semantic_prefilter is not None:
+        verdict = semantic_prefilter(condition, context)
+        if verdict is not None:
+            return verdict, "model"
+    return None, None
+
+
+def _is_audited(cache_key: str) -> bool:
+    # Deterministic, so that a check is audited or not whenever it's evaluated
+    return int(cache_key[:8], 16) / 16**8 < prefilter_audit_rate
+
+
+def _escalate(
+    cache_key: str, condition: str, context: str, local_verdict: Optional[bool]
+) -> None:
+    with _verdicts_lock:
+        if cache_key in _escalated_checks:
+            return
+        _escalated_checks[cache_key] = (condition, context, local_verdict)
+    prefilter_stats.add_once(
+        cache_key, "checks", "audited" if local_verdict is not None else "escalated"
+    )
+
+
+def _record_verdict(cache_key: str, verdict: bool) -> None:
+    with _verdicts_lock:
+        escalated = _escalated_checks.pop(cache_key, None)
+        if escalated is None:
+            return
+        condition, context, local_verdict = escalated
+        if local_verdict is not None and local_verdict != verdict:
+            prefilter_stats.add("disagreements")
+        if verdicts_path:
+            record = {"condition": condition, "context": context, "verdict": verdict}
+            line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            # A single O_APPEND write, so that the lines of concurrent batch workers don't interleave
+            fd = os.open(verdicts_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+
+def _drop_escalation(cache_key: str) -> None:
+    """For an escalated check the LLM didn't answer (it is escalated again if asked again)."""
+    with _verdicts_lock:
+        escalated = _escalated_checks.pop(cache_key, None)
+    if escalated is not None:
+        prefilter_stats.add_once(f"unresolved:{cache_key}", "unresolved")
+
+
+@profiled("semantic_is_true")
+def semantic_is_true(
+    condition: str,
+    context: Optional[str | Callable] = None,
+    prefilter: Optional[Prefilter] = None,
+) -> bool:
+    """
+    `prefilter` is a cheap rule (e.g. a `KeywordRule`) returning a verdict
+    when it is confident about the condition, or None to ask the LLM.
+    """
     # Context can be a callable, in the case if it's set at initialization but can be dynamic
     if callable(context):
         context = context()
+    raw_context = context or ""
 
     additional_guidance = "According to your internal knowledge"
     if context:
         additional_guidance = "According to the provided context"
         context = f"<context>\n{context}\n</context>\n\n\n"
     instruction = f"{context}{additional_guidance}, would you say the following condition is valid?\n\nCONDITION = '{condition}'"
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
+
+    cache_key = SemanticCache.key(SEMANTIC_MODEL, condition, context or "")
+    cached_verdict = semantic_cache.get(cache_key)
+    if cached_verdict is not None:
+        return cached_verdict
+
+    local_verdict, source = _local_verdict(condition, raw_context, prefilter)
+    if local_verdict is not None:
+        if not _is_audited(cache_key):
+            prefilter_stats.add_once(cache_key, "checks", source)
+            return local_verdict
+    collector = _semantic_collector.get()
+    if collector is not None:
+        collector.add(cache_key, condition, context or "")
+        _escalate(cache_key, condition, raw_context, local_verdict)
+        return False
+
+    _escalate(cache_key, condition, raw_context, local_verdict)
+
+    completion = get_client().parse(
+        model=SEMANTIC_MODEL,
         messages=[
             {
                 "role": "system",
@@ -43,7 +237,100 @@ def semantic_is_true(condition: str, context: Optional[str | Callable] = None) -
                 json_log = choice_taken_by_employee.model_dump()
                 json_log["prompt"] = instruction
                 json.dump(json_log, f, ensure_ascii=False, indent=4)
+        semantic_cache.set(cache_key, choice_taken_by_employee.condition_is_verified)
+        _record_verdict(cache_key, choice_taken_by_employee.condition_is_verified)
         return choice_taken_by_employee.condition_is_verified
 
     print("Warning! choice_taken_by_employee is None.")
+    _drop_escalation(cache_key)
     return False
+
+
+def _resolve_batch(items: list[tuple[str, str, str]]) -> int:
+    prompt = "For each of the following items, according to the provided context (or to your internal knowledge if there is none), would you say the condition is valid? Give one verdict per item, with the item's index.\n\n"
+    for i, (_, condition, context) in enumerate(items):
+        prompt += f"<item index=\"{i}\">\n{context}CONDITION = '{condition}'\n</item>\n\n"
+
+    completion = get_client().parse(
+        model=SEMANTIC_MODEL,
+        messages=[{"role": "system", "content": prompt}],
+        response_format=BatchedVerification,
+    )
+    verification = completion.choices[0].message.parsed
+    if not verification:
+        print("Warning! The batched semantic verification is None.")
+        for cache_key, _, _ in items:
+            _drop_escalation(cache_key)
+        return 0
+
+    if os.environ["LOG_SEMANTIC"] == "True":
+        with open(f"logs/{time.time()}.json", "w", encoding="utf-8") as f:
+            json_log = verification.model_dump()
+            json_log["prompt"] = prompt
+            json.dump(json_log, f, ensure_ascii=False, indent=4)
+
+    resolved = 0
+    answered = set()
+    for verdict in verification.verdicts:
+        if 0 <= verdict.index < len(items):
+            semantic_cache.set(items[verdict.index][0], verdict.condition_is_verified)
+            _record_verdict(items[verdict.index][0], verdict.condition_is_verified)
+            answered.add(verdict.index)
+            resolved += 1
+    for i, (cache_key, _, _) in enumerate(items):
+        if i not in answered:
+            _drop_escalation(cache_key)
+    return resolved
+
+
+@profiled("semantic_batch")
+def resolve_semantic_checks(
+    questions: dict[str, tuple[str, str]],
+    max_items_per_request: int = 16,
+    max_chars_per_request: int = 60000,
+) -> int:
+    """
+    Answers the collected questions with batched requests, and stores the
+    verdicts in the semantic cache. Returns the number of verdicts obtained;
+    the questions left unanswered are asked one by one later on.
+    """
+    batches: list[list[tuple[str, str, str]]] = [[]]
+    batch_chars = 0
+    for cache_key, (condition, context) in questions.items():
+        item_chars = len(condition) + len(context)
+        if batches[-1] and (
+            len(batches[-1]) >= max_items_per_request
+            or batch_chars + item_chars > max_chars_per_request
+        ):
+            batches.append([])
+            batch_chars = 0
+        batches[-1].append((cache_key, condition, context))
+        batch_chars += item_chars
+
+    batches = [batch for batch in batches if batch]
+    if len(batches) <= 1:
+        return sum(_resolve_batch(batch) for batch in batches)
+    contexts = [contextvars.copy_context() for _ in batches]
+    with ThreadPoolExecutor(max_workers=min(4, len(batches))) as executor:
+        return sum(
+            executor.map(lambda c, batch: c.run(_resolve_batch, batch), contexts, batches)
+        )
+
+
+def batch_semantic_checks(evaluate: Callable[[], object], max_rounds: int = 3) -> int:
+    """
+    Runs `evaluate` (which evaluates some conditions) in collect mode, and
+    resolves the collected semantic checks in batches. As conditions may
+    short-circuit on unresolved checks, this is repeated until no new check
+    is found, at most `max_rounds` times. Returns the number of verdicts obtained.
+    """
+    asked: set[str] = set()
+    resolved = 0
+    for _ in range(max_rounds):
+        with collecting_semantic_checks(asked) as collector:
+            evaluate()
+        if not collector.questions:
+            break
+        asked.update(collector.questions)
+        resolved += resolve_semantic_checks(collector.questions)
+    return resolved